@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Measure cold start latency of the Lambda functions. Each run is done in a
+# fresh interpreter, timing the module import, creation of the S3 resource
+# and, with --invoke, the first and second handler invocation. Invoking the
+# handlers reads and writes real S3 objects (like the test_local_* scripts).
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+FUNCTIONS = ["downloader", "parser", "curator"]
+
+# Sample events, as received by each function
+EVENTS = {
+    "downloader": {
+        "url": "https://ftp.afrinic.net/pub/stats/afrinic/delegated-afrinic-extended-latest",
+        "loglevel": "WARNING",
+    },
+    "parser": {
+        "detail": {
+            "bucket": {"name": "cc2asn-data"},
+            "object": {"key": "RIR-SEF/delegated-afrinic-extended-latest"},
+        }
+    },
+    "curator": {
+        "detail": {
+            "bucket": {"name": "cc2asn-data"},
+            "object": {"key": "parsed/delegated-afrinic-extended-latest.json"},
+        }
+    },
+}
+
+# Code run in the fresh interpreter
+PROBE = """
+import os, json, time
+os.environ.setdefault("LogLevel", "warning")
+t0 = time.perf_counter()
+import {function} as fn
+t1 = time.perf_counter()
+fn.storage.get(fn.REGION).s3()
+t2 = time.perf_counter()
+timings = {{"import": t1 - t0, "s3": t2 - t1}}
+event = {event}
+if event is not None:
+    fn.handler(event, "")
+    t3 = time.perf_counter()
+    fn.handler(event, "")
+    timings.update(first=t3 - t2, warm=time.perf_counter() - t3)
+print(json.dumps(timings))
+"""
+
+
+# Run a single cold start of the function, returning timings in seconds
+def coldstart(function, invoke):
+    event = EVENTS[function] if invoke else None
+    probe = PROBE.format(function=function, event=repr(event))
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", probe], stdout=subprocess.PIPE, text=True, check=True
+    )
+    timings = json.loads(out.stdout.splitlines()[-1])
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lambda cold start benchmark")
+    parser.add_argument("functions", nargs="*", default=FUNCTIONS)
+    parser.add_argument("-n", dest="runs", type=int, default=5, help="Runs")
+    parser.add_argument("--invoke", action="store_true", help="Invoke handlers")
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args()
+
+    results = {}
+    for function in args.functions:
+        runs = [coldstart(function, args.invoke) for _ in range(args.runs)]
+        results[function] = {
+            stage: statistics.median(run[stage] for run in runs) for stage in runs[0]
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for function, timings in results.items():
+            stages = " ".join(f"{k}={v * 1000:.1f}ms" for k, v in timings.items())
+            print(f"{function:<12} {stages}")
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# End-to-end benchmark of the data pipeline on synthetic SEF data (sefgen.py).
+# Times parser(), the JSON round trip between parser and curator, validation
+# and dbstore() with local directory storage and, with --legacy, query
+# throughput of the legacy server serving the curated files. Results are
+# written as JSON, and can be compared against a previous run to catch
+# regressions.
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import argparse
+import platform
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import sefgen
+import parser
+import curator
+import storage
+import validate
+
+LEGACY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../legacy")
+
+
+# Run fn repeatedly, returning timing summary and the last result
+def measure(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - start)
+    stats = {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+    return stats, result
+
+
+# Start the legacy server on a free port, serving files from dbdir
+def start_legacy(python2, dbdir, tmpdir):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    conf = os.path.join(tmpdir, "cc2asn.conf")
+    with open(conf, "w") as f:
+        f.write(f'DBDIR="{dbdir}"\nPORT="{port}"\nRATE="0"\nMAXCONNECTIONS="0"\n')
+    proc = subprocess.Popen(
+        [python2, os.path.join(LEGACY, "cc2asn-server.py"), "-c", conf]
+    )
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return proc, port
+        except ConnectionRefusedError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Failed to start legacy server")
+
+
+# Send data to the server and read the full reply
+def query(port, data):
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(data.encode())
+        s.shutdown(socket.SHUT_WR)
+        reply = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                return b"".join(reply)
+            reply.append(chunk)
+
+
+# Query throughput of the legacy server, one query per connection and as
+# a single batch
+def bench_legacy(port, queries, concurrency, repeat):
+    def single():
+        with ThreadPoolExecutor(concurrency) as pool:
+            return sum(map(len, pool.map(lambda q: query(port, q + "\n"), queries)))
+
+    def batch():
+        return len(query(port, "\n".join(queries) + "\n"))
+
+    results = {}
+    for name, fn in (("legacy_single", single), ("legacy_batch", batch)):
+        stats, nbytes = measure(fn, repeat)
+        stats["qps"] = len(queries) / stats["median"]
+        stats["bytes"] = nbytes
+        results[name] = stats
+    return results
+
+
+# Compare medians with a previous run. Returns list of regressed stages.
+def compare(results, baseline, threshold):
+    regressions = []
+    for stage, stats in results["stages"].items():
+        old = baseline["stages"].get(stage)
+        if old and stats["median"] > old["median"] * threshold:
+            regressions.append(
+                f"{stage}: {old['median'] * 1000:.1f}ms -> {stats['median'] * 1000:.1f}ms"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="CC2ASN pipeline benchmark")
+    argp.add_argument("-n", dest="records", type=int, default=100000)
+    argp.add_argument("-c", dest="countries", help="Country mix, e.g. NO:2,SE:1")
+    argp.add_argument("-r", dest="ratios", default="40:45:15", help="ASN:IPv4:IPv6")
+    argp.add_argument("-p", dest="nonpow2", type=float, default=0.1)
+    argp.add_argument("-s", dest="seed", type=int, default=0)
+    argp.add_argument("--repeat", type=int, default=5)
+    argp.add_argument("--legacy", action="store_true", help="Bench legacy server")
+    argp.add_argument("--python2", default="python2", help="Legacy interpreter")
+    argp.add_argument("--concurrency", type=int, default=8)
+    argp.add_argument("-o", dest="output", help="Write results to JSON file")
+    argp.add_argument("--compare", help="Previous results to compare against")
+    argp.add_argument("--threshold", type=float, default=1.2)
+    args = argp.parse_args()
+
+    params = {
+        "records": args.records,
+        "countries": args.countries,
+        "ratios": args.ratios,
+        "nonpow2": args.nonpow2,
+        "seed": args.seed,
+        "repeat": args.repeat,
+    }
+    sefdata = sefgen.generate(
+        args.records,
+        sefgen.parse_countries(args.countries) if args.countries else None,
+        [float(r) for r in args.ratios.split(":")],
+        args.nonpow2,
+        seed=args.seed,
+    )
+
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stages["parse"], ccdata = measure(lambda: parser.parser(sefdata), args.repeat)
+        stages["serialise"], text = measure(lambda: json.dumps(ccdata), args.repeat)
+        stages["deserialise"], _ = measure(lambda: json.loads(text), args.repeat)
+
+        storage.use(storage.LocalStorage(tmpdir))
+        validator = validate.Validator(storage.get(curator.REGION), curator.BUCKET)
+        stages["validate"], _ = measure(lambda: validator.check(ccdata), args.repeat)
+        stages["dbstore"], files = measure(
+            lambda: curator.dbstore(json.loads(text)), args.repeat
+        )
+
+        if args.legacy:
+            dbdir = os.path.join(tmpdir, curator.BUCKET, "latest")
+            queries = [
+                f"{rectype} {cc}"
+                for cc in sorted(ccdata.keys() - parser.META)
+                for rectype in ("ASN", "IPV4", "IPV6", "ALL")
+            ]
+            proc, port = start_legacy(args.python2, dbdir, tmpdir)
+            try:
+                stages.update(
+                    bench_legacy(port, queries, args.concurrency, args.repeat)
+                )
+            finally:
+                proc.kill()
+                proc.wait()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": params,
+        "lines": len(sefdata),
+        "countries": len(ccdata.keys() - parser.META),
+        "files": files,
+        "stages": stages,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    for stage, stats in stages.items():
+        qps = f" ({stats['qps']:.0f} queries/s)" if "qps" in stats else ""
+        print(f"{stage:<14} {stats['median'] * 1000:9.1f}ms{qps}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -3,22 +3,37 @@ import json
 import logging
 from datetime import datetime
 
-import boto3
 import natsort
 
+import ranges
+import storage
+import holders
+from history import History
+from validate import Validator
+from timing import Timings, profiled
+
 # AWS configuration
 REGION = "eu-west-1"  # AWS region name
 BUCKET = "cc2asn-db"  # S3 bucket for curated data
 
+# Default country groups, served as @<NAME>. Override with the Groups
+# environment variable, e.g. "EU=AT,BE,BG;NORDIC=DK,FI,IS,NO,SE". Each RIR is
+# also a group (e.g. @RIPENCC) of all records it has delegated.
+GROUPS = {
+    "EU": "AT,BE,BG,CY,CZ,DE,DK,EE,ES,FI,FR,GR,HR,HU,IE,IT,LT,LU,LV,MT,NL,PL,PT,"
+    "RO,SE,SI,SK".split(","),
+    "NORDIC": ["DK", "FI", "IS", "NO", "SE"],
+}
+GROUP = "@"  # Prefix of group file names
+RECTYPES = ["ASN", "IPV4", "IPV6"]
+
 #  Setup logging
 logger = logging.getLogger(__name__)
 
-# Function that reads a file from S3 and returns its content
+# Function that reads a file from S3 and returns its (raw) content
 def read_s3_file(bucket, key):
-    s3 = boto3.resource(service_name="s3", region_name=REGION)
     try:
-        obj = s3.Object(bucket, key)
-        data = obj.get()["Body"].read().decode("utf-8")
+        data = storage.get(REGION).read(bucket, key)
         logger.info(f"Successfully read {bucket}/{key}")
     except Exception as e:
         logger.error(f"Failed to read {bucket}/{key}")
@@ -27,9 +42,118 @@ def read_s3_file(bucket, key):
     return data
 
 
+# Parse group definitions like "EU=AT,BE,BG;NORDIC=DK,FI,IS,NO,SE"
+def read_groups(text):
+    groups = {}
+    for item in text.split(";"):
+        name, _, members = item.partition("=")
+        if name.strip():
+            groups[name.strip().upper()] = [
+                cc.strip().upper() for cc in members.split(",") if cc.strip()
+            ]
+    return groups
+
+
+# Group definitions from the environment, or the defaults
+def get_groups():
+    text = os.getenv("Groups")
+    return read_groups(text) if text else GROUPS
+
+
+# Merged, deduplicated and aggregated records of each type for a group. Member
+# countries that are not in ccdata (delegated by another RIR than the one
+# being curated) are read from the latest files.
+def group_data(store, ccdata, members):
+    typedata = {}
+    for rectype in RECTYPES:
+        records = []
+        for cc in members:
+            if cc in ccdata:
+                records += ccdata[cc].get(rectype, [])
+                continue
+            try:
+                data = store.read(BUCKET, f"latest/{cc}_{rectype}").decode()
+                records += data.splitlines()
+            except Exception:
+                pass
+        if records:
+            typedata[rectype] = ranges.aggregate(rectype, records)
+    return typedata
+
+
+# Precompute the groups with members in ccdata, and the group of each RIR in
+# registries ({registry: {cc: {rectype: records}}}). Returns the number of
+# files written.
+def store_groups(store, ccdata, groups, registries, timings):
+    fc = 0
+    for name, members in groups.items():
+        if not any(cc in ccdata for cc in members):
+            continue
+        with timings.stage("groups"):
+            typedata = group_data(store, ccdata, members)
+        fc += write_group(store, name, typedata, timings)
+    for registry, rirdata in registries.items():
+        with timings.stage("groups"):
+            typedata = group_data(store, rirdata, list(rirdata))
+        fc += write_group(store, registry, typedata, timings)
+    return fc
+
+
+# Write the files of a group (one per record type, and combined)
+def write_group(store, name, typedata, timings):
+    fc = 0
+    files = {f"{GROUP}{name}_{t}": typedata.get(t, []) for t in RECTYPES}
+    files[f"{GROUP}{name}_ALL"] = [r for t in RECTYPES for r in typedata.get(t, [])]
+    for filename, filedata in files.items():
+        key = f"latest/{filename}"
+        try:
+            with timings.stage("upload"):
+                store.write(BUCKET, key, "\n".join(filedata))
+            fc += 1
+        except Exception as e:
+            logger.error(f"Failed to write s3:{BUCKET}/{key}")
+            logger.exception(e)
+    return fc
+
+
+# Update the history of files that are no longer in the data with no records,
+# and list the files with history. A file is only cleared when none of the
+# RIRs of its records has it any more, as data of a single RIR says nothing
+# about the others.
+def untrack(history, date, ccdata, registries, timings):
+    current = {}
+    for registry in sorted(registries):
+        for cc, typedata in registries[registry].items():
+            if cc and cc in ccdata:
+                for rectype in typedata:
+                    current.setdefault(f"{cc}_{rectype}", []).append(registry)
+
+    fc = 0
+    tracked = history.tracked()
+    for name, owners in tracked.items():
+        others = [r for r in owners if r not in registries]
+        if name in current or others:
+            current[name] = sorted(set(current.get(name, []) + others))
+            continue
+        try:
+            with timings.stage("history"):
+                fc += history.update(name, date, [])
+        except Exception as e:
+            logger.error(f"Failed to update history of {name}")
+            logger.exception(e)
+            current[name] = owners
+    if current != tracked:
+        history.track(current)
+        fc += 1
+    return fc
+
+
 # Store structure data to S3:
-def dbstore(ccdata):
-    s3 = boto3.resource(service_name="s3", region_name=REGION)
+def dbstore(ccdata, timings=None, groups=None):
+    store = storage.get(REGION)
+    history = History(store, BUCKET)
+    if timings is None:
+        timings = Timings("dbstore")
     if "DATE" in ccdata:
         # Get and remove the generation date
         yyyy = ccdata["DATE"][:4]
@@ -47,7 +171,28 @@ def dbstore(ccdata):
         logger.warning("No RIR generation date found")
         usedate = False
 
+    # Record counts and ranges are only used by the validation
+    ccdata.pop("COUNTS", None)
+    ccdata.pop("RANGES", None)
+
+    # RIR of the data, or the data of each RIR when several are merged
+    registries = ccdata.pop("REGISTRIES", {})
+    registry = ccdata.pop("REGISTRY", None)
+    if registry:
+        registries[registry] = ccdata
+
     fc = 0
+    # Store the holder index of each registry
+    for registry, ids in ccdata.pop("HOLDERS", {}).items():
+        key = f"latest/{holders.PREFIX}_{registry}"
+        try:
+            with timings.stage("upload"):
+                store.write(BUCKET, key, json.dumps(ids))
+            fc += 1
+        except Exception as e:
+            logger.error(f"Failed to write s3:{BUCKET}/{key}")
+            logger.exception(e)
+
     # For each country in the dataset
     for cc in ccdata:
         logger.debug(f"Processing country: {cc}")
@@ -59,36 +204,70 @@ def dbstore(ccdata):
         types = sorted(typedata.keys())
 
         # Create one file for each record type
-        for rectype in types:
-            if rectype == "IPV6":
-                data = sorted(typedata[rectype])
-            else:
-                data = natsort.natsorted(typedata[rectype])
-            alldata += data
-            files[f"{cc}_{rectype}"] = data
+        with timings.stage("sort"):
+            for rectype in types:
+                if rectype == "IPV6":
+                    data = sorted(typedata[rectype])
+                else:
+                    data = natsort.natsorted(typedata[rectype])
+                alldata += data
+                files[f"{cc}_{rectype}"] = data
 
         # Create a combined file as well
         files[f"{cc}_ALL"] = alldata
 
         # Write files to S3
         for filename, filedata in files.items():
+            body = "\n".join(filedata)
+            timings.count("records", len(filedata))
+            timings.count("bytes_written", len(body))
 
-            if usedate:  # Have a valid generation date for the data
-                keydate = f"{yyyy}/{mm}/{dd}/{filename}"
+            # Have a valid generation date for the data. The combined file
+            # is not kept, as it can be made from the others.
+            if usedate and not filename.endswith("_ALL"):
                 try:
-                    s3.Object(BUCKET, keydate).put(Body="\n".join(filedata))
-                    fc += 1
+                    with timings.stage("history"):
+                        fc += history.update(filename, f"{yyyy}{mm}{dd}", filedata)
                 except Exception as e:
-                    logger.error(f"Failed to write s3:{BUCKET}/{keydate}")
+                    logger.error(f"Failed to update history of {filename}")
                     logger.exception(e)
 
             keylatest = f"latest/{filename}"
             try:
-                s3.Object(BUCKET, keylatest).put(Body="\n".join(filedata))
+                with timings.stage("upload"):
+                    store.write(BUCKET, keylatest, body)
                 fc += 1
             except Exception as e:
                 logger.error(f"Failed to write s3:{BUCKET}/{keylatest}")
                 logger.exception(e)
+
+    # Files that have lost all their records
+    if usedate and registries:
+        fc += untrack(history, f"{yyyy}{mm}{dd}", ccdata, registries, timings)
+
+    # Precompute country and RIR groups
+    groups = get_groups() if groups is None else groups
+    fc += store_groups(store, ccdata, groups, registries, timings)
+    return fc
+
+
+# Check the data (see validate.py) and store it, unless a check exceeds its
+# limit and force is not set. Returns the number of files created.
+def publish(ccdata, timings=None, groups=None, force=False):
+    if timings is None:
+        timings = Timings("publish")
+    validator = Validator(storage.get(REGION), BUCKET)
+    with timings.stage("validate"):
+        report = validator.check(ccdata)
+    report.log(logger)
+    blocked = report.blocked()
+    if blocked:
+        if not force:
+            logger.error(f"Not publishing, limits exceeded: {', '.join(blocked)}")
+            return 0
+        logger.warning(f"Publishing anyway, limits exceeded: {', '.join(blocked)}")
+    fc = dbstore(ccdata, timings, groups)
+    validator.save(report)
     return fc
 
 
@@ -108,8 +287,17 @@ def handler(event, context):
     logger.debug(f"Processing {srckey} from {srcbucket}")
 
     # Read parsed file and struture the data
-    ccdata = json.loads(read_s3_file(srcbucket, srckey))
-    fc = dbstore(ccdata)
+    timings = Timings("curator")
+    with profiled(logger):
+        with timings.stage("read"):
+            raw = read_s3_file(srcbucket, srckey)
+        with timings.stage("decode"):
+            ccdata = json.loads(raw)
+        fc = publish(ccdata, timings)
     logger.info(f"Created {fc} files for {len(ccdata)} countries in {rir} region")
+    timings.count("bytes_read", len(raw))
+    timings.count("countries", len(ccdata))
+    timings.count("files", fc)
+    timings.log(logger)
 
     return
@@ -1,23 +1,46 @@
-# Download and verify a RIR delegation file as specified in the event URL
+# Download and verify a RIR delegation file as specified in the event URL.
+# Run as a script to backfill dated delegation files of an RIR for a range of
+# dates (see backfill()).
 
 import os
 import re
+import bz2
+import sys
+import gzip
 import json
 import time
 import shutil
 import hashlib
 import logging
+import argparse
+import threading
 from contextlib import closing
-from urllib.request import urlopen
+from datetime import datetime, timedelta, timezone
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+import storage
+from timing import Timings, profiled
 
 # AWS configuration
 REGION = "eu-west-1"  # AWS region name
 BUCKET = "cc2asn-data"  # S3 bucket name
 PREFIX = "RIR-SEF"  # Folder in bucket
 
+# Dated delegation files of each RIR. Compressed files are decompressed after
+# they are verified.
+ARCHIVES = {
+    "afrinic": "https://ftp.afrinic.net/pub/stats/afrinic/{yyyy}/delegated-afrinic-extended-{date}",
+    "apnic": "https://ftp.apnic.net/stats/apnic/{yyyy}/delegated-apnic-extended-{date}.gz",
+    "arin": "https://ftp.arin.net/pub/stats/arin/delegated-arin-extended-{date}",
+    "lacnic": "https://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-extended-{date}",
+    "ripencc": "https://ftp.ripe.net/pub/stats/ripencc/{yyyy}/delegated-ripencc-extended-{date}.bz2",
+}
+TIMEOUT = 60  # Seconds before a stalled backfill download is given up
+PUBLISHED = 3  # Days before a missing file is taken as never published
+
 #  Setup logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -61,9 +84,10 @@ def calc_md5(filename):
 def save_to_s3(tmpfile, bucket, key):
     try:
         logger.debug(f"Uploading {tmpfile} to S3://{bucket}/{key}")
-        s3 = boto3.resource(service_name="s3", region_name=REGION)
-        s3.Object(bucket, key).put(Body=open(tmpfile, "rb"))
-        return f"S3://{bucket}/{key}"
+        store = storage.get(REGION)
+        with open(tmpfile, "rb") as data:
+            store.write(bucket, key, data)
+        return store.url(bucket, key)
     except Exception as e:
         logger.exception(e)
         return None
@@ -91,6 +115,125 @@ def cleanup(tmpdir):
         logger.exception(e)
 
 
+# Dates (YYYYMMDD) from start to end, inclusive
+def daterange(start, end):
+    day = datetime.strptime(start, "%Y%m%d")
+    last = datetime.strptime(end, "%Y%m%d")
+    while day <= last:
+        yield day.strftime("%Y%m%d")
+        day += timedelta(days=1)
+
+
+# Download URL to path, continuing a partial file with a Range request.
+# Returns the number of bytes received, or None if there is no such file.
+def download_resume(url, path):
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    request = Request(url)
+    if offset:
+        request.add_header("Range", f"bytes={offset}-")
+    try:
+        with urlopen(request, timeout=TIMEOUT) as response:
+            # Servers without Range support send the whole file
+            resumed = response.status == 206
+            if offset:
+                logger.debug(f"Resuming {url} at {offset}: {resumed}")
+            with open(path, "ab" if resumed else "wb") as f:
+                shutil.copyfileobj(response, f)
+                return f.tell() - offset if resumed else f.tell()
+    except HTTPError as e:
+        if e.code == 404:
+            return None
+        if e.code == 416 and offset:
+            return 0  # Already complete
+        raise
+
+
+# Download and verify a dated file into destdir. Returns the status ("ok",
+# "missing", "invalid" or "failed") and the number of bytes received. A
+# failed download is kept as <file>.part, and continued on the next attempt.
+def fetch_dated(url, destdir):
+    fname = unquote(urlparse(url).path.split("/")[-1])
+    part = os.path.join(destdir, f"{fname}.part")
+    try:
+        received = download_resume(url, part)
+        if received is None:
+            logger.debug(f"{url} not found")
+            return "missing", 0
+        md5sum = get_md5(url)
+    except Exception as e:
+        logger.error(f"Failed to download {url}: {e}")
+        return "failed", 0
+    if md5sum is None or calc_md5(part) != md5sum:
+        logger.error(f"Invalid checksum for {url}")
+        os.remove(part)
+        return "invalid", received
+
+    base, ext = os.path.splitext(fname)
+    opener = {".gz": gzip.open, ".bz2": bz2.open}.get(ext)
+    if opener is None:
+        os.replace(part, os.path.join(destdir, fname))
+    else:
+        with opener(part) as src, open(os.path.join(destdir, base), "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(part)
+    return "ok", received
+
+
+# Dates that are done ({date: status}), stored as JSON after each file so an
+# interrupted backfill continues where it stopped
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.dates = json.load(f)
+        except FileNotFoundError:
+            self.dates = {}
+
+    def __contains__(self, date):
+        return date in self.dates
+
+    def set(self, date, status):
+        with self.lock:
+            self.dates[date] = status
+            with open(f"{self.path}.tmp", "w") as f:
+                json.dump(self.dates, f, indent=1, sort_keys=True)
+            os.replace(f"{self.path}.tmp", self.path)
+
+
+# Download the dated files of an RIR from start to end (YYYYMMDD) into
+# destdir, with up to workers concurrent downloads. Files that are verified,
+# or don't exist PUBLISHED days after their date, are recorded in the
+# checkpoint (.backfill-<rir>.json) and skipped by later runs. Other files
+# are retried. The URL template
+# (default from ARCHIVES) may use {rir}, {yyyy} and {date}. Returns the
+# number of files by status.
+def backfill(rir, start, end, destdir, workers=4, template=None):
+    template = template or ARCHIVES[rir]
+    os.makedirs(destdir, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(destdir, f".backfill-{rir}.json"))
+    dates = [date for date in daterange(start, end) if date not in checkpoint]
+    logger.info(f"Backfilling {len(dates)} dates for {rir} to {destdir}")
+    published = datetime.now(timezone.utc) - timedelta(days=PUBLISHED)
+    published = published.strftime("%Y%m%d")
+
+    def fetch(date):
+        url = template.format(rir=rir, yyyy=date[:4], date=date)
+        status, received = fetch_dated(url, destdir)
+        if status == "ok" or (status == "missing" and date < published):
+            checkpoint.set(date, status)
+        return status, received
+
+    timings = Timings("backfill")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for status, received in pool.map(fetch, dates):
+            timings.count(status, 1)
+            timings.count("bytes_read", received)
+    timings.log(logger)
+    return {k: v for k, v in timings.counts.items() if k != "bytes_read"}
+
+
 # Main Lambda entry point
 def handler(event, context):
     # Set log level
@@ -107,22 +250,49 @@ def handler(event, context):
     if "url" not in event:
         logger.error("Missing url in input event!")
     else:
-        tmpdir = mktmpdir()
-        tmpfile = download(event["url"], tmpdir)
-        if tmpfile is not None:
-            logger.info("Successfully downloaded delegation file")
-            if calc_md5(tmpfile) != get_md5(event["url"]):
-                logger.error("Error! Invalid checksum")
-            else:
-                logger.info("Checksum OK")
-                s3path = save_to_s3(
-                    tmpfile, BUCKET, f"{PREFIX}/{os.path.basename(tmpfile)}"
-                )
-                if s3path is not None:
-                    logger.info(f"Successfully stored on {s3path}")
+        timings = Timings("downloader")
+        with profiled(logger):
+            tmpdir = mktmpdir()
+            with timings.stage("download"):
+                tmpfile = download(event["url"], tmpdir)
+            if tmpfile is not None:
+                logger.info("Successfully downloaded delegation file")
+                timings.count("bytes_read", os.path.getsize(tmpfile))
+                with timings.stage("checksum"):
+                    valid = calc_md5(tmpfile) == get_md5(event["url"])
+                if not valid:
+                    logger.error("Error! Invalid checksum")
                 else:
-                    logger.error("Error! Could not store file on S3")
-            cleanup(tmpdir)
-        else:
-            logger.error("Failed to download delegation file")
+                    logger.info("Checksum OK")
+                    with timings.stage("upload"):
+                        s3path = save_to_s3(
+                            tmpfile, BUCKET, f"{PREFIX}/{os.path.basename(tmpfile)}"
+                        )
+                    if s3path is not None:
+                        logger.info(f"Successfully stored on {s3path}")
+                    else:
+                        logger.error("Error! Could not store file on S3")
+                cleanup(tmpdir)
+            else:
+                logger.error("Failed to download delegation file")
+        timings.log(logger)
     return
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Backfill dated delegation files")
+    argp.add_argument("rir", choices=sorted(ARCHIVES), help="RIR")
+    argp.add_argument("start", help="First date (YYYYMMDD)")
+    argp.add_argument("end", help="Last date (YYYYMMDD)")
+    argp.add_argument("-d", dest="destdir", default="backfill", help="Directory")
+    argp.add_argument("-j", dest="workers", type=int, default=4, help="Downloads")
+    argp.add_argument("-u", dest="template", help="URL template, e.g. {date}")
+    argp.add_argument("-l", dest="loglevel", default="info", help="Log level")
+    args = argp.parse_args()
+
+    logging.basicConfig(stream=sys.stdout, format="%(name)s: %(message)s")
+    logger.setLevel(logging.getLevelName(args.loglevel.upper()))
+    counts = backfill(
+        args.rir, args.start, args.end, args.destdir, args.workers, args.template
+    )
+    sys.exit(1 if counts.get("failed") or counts.get("invalid") else 0)
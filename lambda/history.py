@@ -0,0 +1,157 @@
+# History of the curated files, stored as periodic full checkpoints and daily
+# deltas. For each file (e.g. NO_IPV4) the history is kept in history/<file>/:
+#
+#   index             one line per stored date: "<YYYYMMDD> full|delta <count>"
+#   <YYYYMMDD>.full   all records on that date (checkpoint)
+#   <YYYYMMDD>.delta  records added (+) and removed (-) since the previous date
+#   head              all records on the last stored date
+#
+# The files with history are listed in history/index, one per line with the
+# RIRs of their records: "<file> <RIR>[,<RIR>...]". A file that is no longer
+# in the data of any of its RIRs is updated with no records, so that its
+# records are not seen on later dates. Dates without changes are not stored. The view on a given date is the last
+# checkpoint before it, with the deltas that follow applied. A new checkpoint
+# is made after CHECKPOINT deltas, or when the deltas since the last one hold
+# more records than a full copy, which bounds the cost of reconstruction.
+
+import bisect
+import logging
+
+import natsort
+
+PREFIX = "history"  # Folder in bucket
+CHECKPOINT = 30  # Max number of deltas between checkpoints
+
+logger = logging.getLogger(__name__)
+
+
+# Sort records as in the curated files
+def ordered(rectype, records):
+    if rectype == "IPV6":
+        return sorted(records)
+    return natsort.natsorted(records)
+
+
+class History:
+    def __init__(self, store, bucket):
+        self.store = store
+        self.bucket = bucket
+
+    def key(self, name, filename):
+        return f"{PREFIX}/{name}/{filename}"
+
+    # Read an object, or None if it doesn't exist
+    def read(self, name, filename):
+        try:
+            return self.store.read(self.bucket, self.key(name, filename)).decode()
+        except Exception:
+            return None
+
+    def write(self, name, filename, lines):
+        self.store.write(self.bucket, self.key(name, filename), "\n".join(lines))
+
+    # Files with history and the RIRs of their records, {name: [RIR, ...]}
+    def tracked(self):
+        try:
+            data = self.store.read(self.bucket, f"{PREFIX}/index").decode()
+        except Exception:
+            return {}
+        names = {}
+        for line in data.splitlines():
+            name, registries = line.split()
+            names[name] = registries.split(",")
+        return names
+
+    def track(self, names):
+        lines = [f"{name} {','.join(names[name])}" for name in sorted(names)]
+        self.store.write(self.bucket, f"{PREFIX}/index", "\n".join(lines))
+
+    # List of (date, kind, count) for a file
+    def index(self, name):
+        data = self.read(name, "index")
+        if not data:
+            return []
+        entries = []
+        for line in data.splitlines():
+            date, kind, count = line.split()
+            entries.append((date, kind, int(count)))
+        return entries
+
+    # Reconstruct the records of entry i in the index
+    def reconstruct(self, name, entries, i):
+        start = i
+        while entries[start][1] != "full":
+            start -= 1
+        records = set(self.read(name, f"{entries[start][0]}.full").splitlines())
+        for date, _, _ in entries[start + 1 : i + 1]:
+            for line in self.read(name, f"{date}.delta").splitlines():
+                if line[0] == "+":
+                    records.add(line[1:])
+                else:
+                    records.discard(line[1:])
+        records.discard("")
+        return records
+
+    # Records of a file as they were on date (YYYYMMDD), or None if there is
+    # no history that far back
+    def view(self, name, date):
+        entries = self.index(name)
+        i = bisect.bisect_right([e[0] for e in entries], date) - 1
+        if i < 0:
+            return None
+        rectype = name.rsplit("_", 1)[1]
+        return ordered(rectype, self.reconstruct(name, entries, i))
+
+    # Add the records of a file on date (YYYYMMDD). A date already in the
+    # history is replaced, while dates before the last stored date are
+    # ignored. Returns the number of objects written.
+    def update(self, name, date, records):
+        entries = self.index(name)
+        if entries and date < entries[-1][0]:
+            logger.warning(f"Not updating history of {name}: {date} is too old")
+            return 0
+
+        replaced = bool(entries) and entries[-1][0] == date
+        if replaced:
+            entries.pop()
+            base = (
+                self.reconstruct(name, entries, len(entries) - 1) if entries else None
+            )
+        elif entries:
+            base = set(self.read(name, "head").splitlines())
+            base.discard("")
+        else:
+            base = None
+
+        records = set(records)
+        written = 0
+        if base is None or records != base:
+            added = sorted(records - base) if base is not None else []
+            removed = sorted(base - records) if base is not None else []
+            since = 0
+            for i, (_, kind, count) in enumerate(reversed(entries)):
+                if kind == "full":
+                    deltas = i
+                    break
+                since += count
+            else:
+                deltas = None
+            if (
+                base is None
+                or deltas is None
+                or deltas >= CHECKPOINT
+                or since + len(added) + len(removed) > len(records)
+            ):
+                self.write(name, f"{date}.full", sorted(records))
+                entries.append((date, "full", len(records)))
+            else:
+                delta = [f"+{r}" for r in added] + [f"-{r}" for r in removed]
+                self.write(name, f"{date}.delta", delta)
+                entries.append((date, "delta", len(delta)))
+            written += 1
+        elif not replaced:
+            return 0
+
+        self.write(name, "head", sorted(records))
+        self.write(name, "index", [f"{d} {k} {c}" for d, k, c in entries])
+        return written + 2
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Index of resources (ASNs and prefixes) by holder, built from the opaque-id
+# field of the extended delegation files. A holder is identified by registry
+# and opaque-id, and each of its resources is stored as "record|cc|status".
+#
+# The curator stores one index per registry as JSON ({opaque-id: [entries]})
+# in latest/HOLDERS_<REGISTRY>.
+
+import sys
+import json
+import argparse
+
+import storage
+
+PREFIX = "HOLDERS"  # File name prefix
+REGISTRIES = ["AFRINIC", "APNIC", "ARIN", "LACNIC", "RIPENCC"]
+
+
+# Normalise a resource to the record format (e.g. 64500 -> AS64500)
+def normalise(resource):
+    resource = resource.strip().upper()
+    if resource.isdigit():
+        return f"AS{resource}"
+    return resource
+
+
+class HolderIndex:
+    def __init__(self, holders=None):
+        self.holders = {}  # (registry, opaque-id) -> [entries]
+        self.resources = {}  # record -> (registry, opaque-id)
+        for registry, ids in (holders or {}).items():
+            self.add(registry, ids)
+
+    # Add the holders ({opaque-id: [entries]}) of a registry
+    def add(self, registry, ids):
+        for opaque, entries in ids.items():
+            self.holders[(registry, opaque)] = entries
+            for entry in entries:
+                self.resources[entry.split("|", 1)[0]] = (registry, opaque)
+
+    # (registry, opaque-id) of the holder of a resource, or None
+    def holder(self, resource):
+        return self.resources.get(normalise(resource))
+
+    # Entries of all resources held by the holder of a resource
+    def held_with(self, resource):
+        holder = self.holder(resource)
+        if holder is None:
+            return []
+        return self.holders[holder]
+
+    # Load the indexes of all registries from storage
+    @classmethod
+    def load(cls, store, bucket, registries=REGISTRIES):
+        index = cls()
+        for registry in registries:
+            try:
+                data = store.read(bucket, f"latest/{PREFIX}_{registry}")
+            except Exception:
+                continue
+            index.add(registry, json.loads(data))
+        return index
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Resources held by the same holder")
+    argp.add_argument("resources", nargs="+", help="ASN or prefix, e.g. AS64500")
+    argp.add_argument("-d", dest="root", default="data", help="Storage directory")
+    argp.add_argument("--s3", action="store_true", help="Read from S3")
+    argp.add_argument("-b", dest="bucket", default="cc2asn-db", help="Bucket")
+    args = argp.parse_args()
+
+    if not args.s3:
+        storage.use(storage.LocalStorage(args.root))
+    index = HolderIndex.load(storage.get("eu-west-1"), args.bucket)
+    for resource in args.resources:
+        holder = index.holder(resource)
+        if holder is None:
+            print(f"{resource}: no holder found", file=sys.stderr)
+            continue
+        print(f"# {normalise(resource)} is held by {holder[1]} ({holder[0]})")
+        for entry in index.held_with(resource):
+            print(entry.replace("|", " "))
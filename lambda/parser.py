@@ -7,21 +7,22 @@ import math
 import logging
 import collections
 
-import boto3
+import storage
+from timing import Timings, profiled
 
 # AWS configuration
 REGION = "eu-west-1"  # AWS region name
 PREFIX = "parsed"  # Folder to store parsed files. Bucket is defined in event
+# Keys in parsed (or merged) data that are not countries
+META = {"DATE", "HOLDERS", "REGISTRY", "REGISTRIES", "COUNTS", "RANGES"}
 
 #  Setup logging
 logger = logging.getLogger(__name__)
 
-# Function that reads a file from S3 and returns its content
+# Function that reads a file from S3 and returns its (raw) content
 def read_s3_file(bucket, key):
-    s3 = boto3.resource(service_name="s3", region_name=REGION)
     try:
-        obj = s3.Object(bucket, key)
-        data = obj.get()["Body"].read().decode("utf-8").splitlines()
+        data = storage.get(REGION).read(bucket, key)
         logger.info(f"Successfully read {bucket}/{key}")
     except Exception as e:
         logger.error(f"Failed to read {bucket}/{key}")
@@ -32,10 +33,8 @@ def read_s3_file(bucket, key):
 
 # Function that writes a file to S3
 def write_s3_file(bucket, key, data):
-    s3 = boto3.resource(service_name="s3", region_name=REGION)
     try:
-        obj = s3.Object(bucket, key)
-        obj.put(Body=data)
+        storage.get(REGION).write(bucket, key, data)
         logger.info(f"Successfully wrote {bucket}/{key}")
     except Exception as e:
         logger.error(f"Failed to write {bucket}/{key}")
@@ -50,8 +49,22 @@ def parser(sefdata):
     # Store parsed data in an ordered dictionary
     ccdata = collections.OrderedDict()
 
-    # Data generation date (set by RIR)
+    # Data generation date and registry (set by RIR)
     dgendate = None
+    rir = None
+
+    # Records by registry and holder (opaque-id), as "record|cc|status"
+    holders = {}
+
+    # Number of records declared by the version and summary lines, and the
+    # number of record lines seen, in total (RECORDS) and by type
+    declared = {}
+    seen = {"RECORDS": 0}
+
+    # Start and value of each record by type, as "cc|start|value", for the
+    # validation (records of non power of two IPv4 blocks and ASN blocks only
+    # hold part of the range)
+    extents = {}
 
     for ln in sefdata:
 
@@ -62,19 +75,31 @@ def parser(sefdata):
         if ln.startswith("#"):
             continue
 
-        # Skip summary
+        # Summary line
+        # 0       |1|2   |3|4    |5
+        # registry|*|type|*|count|summary
         if ln.endswith("summary"):
-            continue
-
-        # Skip non-allocated records
-        if ln.rstrip("|").endswith("available") or ln.rstrip("|").endswith("reserved"):
+            summary = ln.split("|")
+            declared[summary[2].upper()] = int(summary[4])
             continue
 
         # Version line
         # 0      |1       |2     |3      |4        |5      |6
         # version|registry|serial|records|startdate|enddate|UTCoffset
         if ln[0].isdigit():
-            dgendate = ln.split("|")[5]
+            version = ln.split("|")
+            rir = version[1].upper()
+            declared["RECORDS"] = int(version[3])
+            dgendate = version[5]
+            continue
+
+        # Count all records, allocated or not
+        rectype = ln.split("|", 3)[2].upper()
+        seen[rectype] = seen.get(rectype, 0) + 1
+        seen["RECORDS"] += 1
+
+        # Skip non-allocated records
+        if ln.rstrip("|").endswith("available") or ln.rstrip("|").endswith("reserved"):
             continue
 
         # Extract records
@@ -96,6 +121,7 @@ def parser(sefdata):
             record = "AS" + start
         else:
             logger.warning(f"Undefined record type: {iptype}")
+        extents.setdefault(iptype, []).append(f"{cc}|{start}|{elements[4]}")
 
         # Structurize records
         typedata = {}
@@ -112,10 +138,21 @@ def parser(sefdata):
         else:
             typedata[iptype] = [record]
             ccdata[cc] = typedata
+
+        # Index record by holder, if the opaque-id extension is present
+        if len(elements) > 7 and elements[7]:
+            registry = holders.setdefault(elements[0], {})
+            registry.setdefault(elements[7], []).append(f"{record}|{cc}|{elements[6]}")
     logger.info(f"Parsed {len(sefdata)} SEF entries into {len(ccdata)} countries")
 
     # Add metadata
     ccdata.update({"DATE": dgendate})  # RIR Generation date
+    if rir:
+        ccdata.update({"REGISTRY": rir})  # RIR of all records
+        ccdata.update({"COUNTS": {rir: {"declared": declared, "seen": seen}}})
+        ccdata.update({"RANGES": {rir: extents}})
+    if holders:
+        ccdata.update({"HOLDERS": holders})  # Holder index
 
     return ccdata
 
@@ -135,8 +172,27 @@ def handler(event, context):
     logger.debug(f"Processing {srckey} from {srcbucket}")
 
     # Parse and store SEF data
-    ccdata = parser(read_s3_file(srcbucket, srckey))
-    parsedfile = f"{PREFIX}/{os.path.basename(srckey)}.json"
-    write_s3_file(srcbucket, parsedfile, json.dumps(ccdata))
+    timings = Timings("parser")
+    with profiled(logger):
+        with timings.stage("read"):
+            raw = read_s3_file(srcbucket, srckey)
+        with timings.stage("decode"):
+            sefdata = raw.decode("utf-8").splitlines()
+        with timings.stage("parse"):
+            ccdata = parser(sefdata)
+        with timings.stage("serialise"):
+            parsed = json.dumps(ccdata)
+        parsedfile = f"{PREFIX}/{os.path.basename(srckey)}.json"
+        with timings.stage("upload"):
+            write_s3_file(srcbucket, parsedfile, parsed)
+    timings.count("bytes_read", len(raw))
+    timings.count("lines", len(sefdata))
+    timings.count("countries", len(ccdata.keys() - META))
+    timings.count(
+        "records",
+        sum(len(v) for cc, d in ccdata.items() if cc not in META for v in d.values()),
+    )
+    timings.count("bytes_written", len(parsed))
+    timings.log(logger)
 
     return
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Run the downloader, parser and curator in a single process, passing data
+# between the stages in memory. Data from all sources is merged before it is
+# curated, so countries with delegations from several RIRs are complete.
+# Curated files are stored in a local directory by default (optionally with
+# the latest files and history in the legacy server DBDIR and HISTDIR), or in
+# S3 with --s3.
+import re
+import sys
+import json
+import logging
+import argparse
+
+import storage
+import parser
+import history
+import curator
+import downloader
+from timing import Timings
+
+# Default sources
+SOURCES = [
+    "https://ftp.arin.net/pub/stats/arin/delegated-arin-extended-latest",
+    "https://ftp.ripe.net/ripe/stats/delegated-ripencc-extended-latest",
+    "https://ftp.afrinic.net/pub/stats/afrinic/delegated-afrinic-extended-latest",
+    "https://ftp.apnic.net/pub/stats/apnic/delegated-apnic-extended-latest",
+    "https://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-extended-latest",
+]
+
+#  Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Read settings (RIR URLs, DBDIR) from a legacy cc2asn.conf
+def read_conf(path):
+    conf = {}
+    with open(path) as f:
+        for line in f:
+            match = re.match(r'^(\w+)="(.*)"$', line.strip())
+            if match is not None:
+                conf[match.group(1)] = match.group(2)
+    return conf
+
+
+# Get SEF data from a URL (verified against its MD5 sum) or a local file, or
+# None if it fails for any reason (e.g. a missing or unreachable MD5 sum)
+def fetch(source, tmpdir):
+    try:
+        if "://" not in source:
+            with open(source, "rb") as f:
+                return f.read()
+
+        tmpfile = downloader.download(source, tmpdir)
+        if tmpfile is None:
+            logger.error(f"Failed to download {source}")
+            return None
+        if downloader.calc_md5(tmpfile) != downloader.get_md5(source):
+            logger.error(f"Invalid checksum for {source}")
+            return None
+        with open(tmpfile, "rb") as f:
+            return f.read()
+    except Exception as e:
+        logger.error(f"Failed to fetch {source}")
+        logger.exception(e)
+        return None
+
+
+# Merge parsed data into ccdata. The most recent generation date is kept,
+# and the data of each RIR is kept for the RIR groups.
+def merge(ccdata, parsed):
+    date = parsed.pop("DATE", None)
+    if date and (ccdata.get("DATE") is None or date > ccdata["DATE"]):
+        ccdata["DATE"] = date
+    ccdata.setdefault("HOLDERS", {}).update(parsed.pop("HOLDERS", {}))
+    ccdata.setdefault("COUNTS", {}).update(parsed.pop("COUNTS", {}))
+    ccdata.setdefault("RANGES", {}).update(parsed.pop("RANGES", {}))
+    registry = parsed.pop("REGISTRY", None)
+    if registry:
+        ccdata.setdefault("REGISTRIES", {})[registry] = dict(parsed)
+    for cc, typedata in parsed.items():
+        merged = ccdata.setdefault(cc, {})
+        for rectype, records in typedata.items():
+            merged.setdefault(rectype, []).extend(records)
+
+
+# Country groups from GROUP_<NAME>="CC,CC,..." settings in a legacy config, or
+# None if there are none
+def conf_groups(conf):
+    groups = {
+        key[len("GROUP_") :]: [cc.strip() for cc in value.upper().split(",")]
+        for key, value in conf.items()
+        if key.startswith("GROUP_")
+    }
+    return groups or None
+
+
+# Run all stages for the sources, returning number of files created. Nothing
+# is published if a source fails, as countries with delegations from several
+# RIRs would be incomplete, unless force is set.
+def run(sources, keep=False, groups=None, force=False):
+    timings = Timings("pipeline")
+    ccdata = {}
+    tmpdir = downloader.mktmpdir()
+    try:
+        for source in sources:
+            name = source.rstrip("/").split("/")[-1]
+            with timings.stage("download"):
+                raw = fetch(source, tmpdir)
+            if raw is None:
+                if not force:
+                    logger.error(f"Not publishing without {name}")
+                    return 0
+                logger.warning(f"Publishing without {name}")
+                continue
+            timings.count("bytes_read", len(raw))
+            with timings.stage("decode"):
+                sefdata = raw.decode("utf-8").splitlines()
+            with timings.stage("parse"):
+                parsed = parser.parser(sefdata)
+            if keep:
+                # Store intermediate files as the Lambda functions do
+                sefpath = f"{tmpdir}/{name}" if "://" in source else source
+                with timings.stage("upload"):
+                    downloader.save_to_s3(
+                        sefpath, downloader.BUCKET, f"{downloader.PREFIX}/{name}"
+                    )
+                    parser.write_s3_file(
+                        downloader.BUCKET,
+                        f"{parser.PREFIX}/{name}.json",
+                        json.dumps(parsed),
+                    )
+            with timings.stage("merge"):
+                merge(ccdata, parsed)
+    finally:
+        downloader.cleanup(tmpdir)
+
+    if not ccdata:
+        logger.error("No data to curate")
+        return 0
+    countries = len(ccdata.keys() - parser.META)
+    fc = curator.publish(ccdata, timings, groups, force)
+    logger.info(f"Created {fc} files for {countries} countries")
+    timings.count("countries", countries)
+    timings.count("files", fc)
+    timings.log(logger)
+    return fc
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Run the CC2ASN pipeline locally")
+    argp.add_argument("sources", nargs="*", help="Delegation file URLs or paths")
+    argp.add_argument("-c", dest="confpath", help="Legacy config (RIRs and DBDIR)")
+    argp.add_argument("-d", dest="root", default="data", help="Storage directory")
+    argp.add_argument("--dbdir", help="Store latest files in this directory")
+    argp.add_argument("--histdir", help="Store history in this directory")
+    argp.add_argument("--s3", action="store_true", help="Store in S3")
+    argp.add_argument("--keep", action="store_true", help="Store intermediate files")
+    argp.add_argument(
+        "--force", action="store_true", help="Publish incomplete or invalid data"
+    )
+    argp.add_argument("-l", dest="loglevel", default="info", help="Log level")
+    args = argp.parse_args()
+
+    level = logging.getLevelName(args.loglevel.upper())
+    logging.basicConfig(stream=sys.stdout, format="%(name)s: %(message)s")
+    for module in (sys.modules[__name__], downloader, parser, curator):
+        module.logger.setLevel(level)
+
+    sources, dbdir, histdir, groups = args.sources, args.dbdir, args.histdir, None
+    if args.confpath is not None:
+        conf = read_conf(args.confpath)
+        rirs = sorted(k for k in conf if re.match(r"^RIR\d+$", k))
+        sources = sources or [conf[k] for k in rirs]
+        dbdir = dbdir or conf.get("DBDIR")
+        histdir = histdir or conf.get("HISTDIR")
+        groups = conf_groups(conf)
+
+    if not args.s3:
+        paths = {}
+        if dbdir:
+            paths[f"{curator.BUCKET}/latest"] = dbdir
+        if histdir:
+            paths[f"{curator.BUCKET}/{history.PREFIX}"] = histdir
+        storage.use(storage.LocalStorage(args.root, paths))
+
+    sys.exit(0 if run(sources or SOURCES, args.keep, groups, args.force) else 1)
@@ -0,0 +1,62 @@
+# Records (ASNs and prefixes) as integer ranges. Ranges are (start, end) tuples
+# with an inclusive end, and are merged in O(n log n) by sorting on start.
+
+import socket
+import ipaddress
+
+import natsort
+
+BITS = {"IPV4": 32, "IPV6": 128}
+FAMILY = {"IPV4": socket.AF_INET, "IPV6": socket.AF_INET6}
+
+
+# Range covered by a record, e.g. "AS64500" or "10.0.0.0/8". Prefixes are not
+# required to be aligned, as the parser rounds odd IPv4 block sizes down to the
+# nearest prefix length.
+def span(rectype, record):
+    if rectype == "ASN":
+        asn = int(record[2:])
+        return asn, asn
+    address, length = record.split("/")
+    start = int.from_bytes(socket.inet_pton(FAMILY[rectype], address), "big")
+    return start, start + (1 << (BITS[rectype] - int(length))) - 1
+
+
+# Range of a SEF record, from its start and value (the number of ASNs or IPv4
+# addresses, or the IPv6 prefix length)
+def extent(rectype, start, value):
+    if rectype == "ASN":
+        return int(start), int(start) + int(value) - 1
+    first = int.from_bytes(socket.inet_pton(FAMILY[rectype], start), "big")
+    if rectype == "IPV4":
+        return first, first + int(value) - 1
+    return first, first + (1 << (128 - int(value))) - 1
+
+
+# Merge overlapping and adjacent ranges
+def merge(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Merge, deduplicate and aggregate records of a type. ASNs are listed one per
+# line as in the country files, and prefixes as the fewest covering CIDRs (in
+# upper case, as the parser writes them).
+def aggregate(rectype, records):
+    ranges = merge(span(rectype, record) for record in set(records))
+    if rectype == "ASN":
+        return natsort.natsorted(
+            f"AS{asn}" for start, end in ranges for asn in range(start, end + 1)
+        )
+    address = ipaddress.IPv4Address if rectype == "IPV4" else ipaddress.IPv6Address
+    return [
+        str(network).upper()
+        for start, end in ranges
+        for network in ipaddress.summarize_address_range(address(start), address(end))
+    ]
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Generate synthetic RIR delegation files in the SEF format, for benchmarks.
+# The output is deterministic for a given set of parameters and seed.
+# https://ftp.ripe.net/pub/stats/ripencc/RIR-Statistics-Exchange-Format.txt
+
+import sys
+import random
+import argparse
+import ipaddress
+
+# Default country mix (relative weights)
+COUNTRIES = {
+    "US": 30,
+    "CN": 10,
+    "JP": 6,
+    "DE": 6,
+    "GB": 5,
+    "BR": 5,
+    "FR": 4,
+    "NL": 4,
+    "RU": 4,
+    "IN": 4,
+    "AU": 3,
+    "CA": 3,
+    "IT": 3,
+    "ES": 2,
+    "SE": 2,
+    "NO": 2,
+    "PL": 2,
+    "ZA": 2,
+    "AR": 1,
+    "IS": 1,
+}
+
+
+# Each registry gets its own ASN and address space, after that of the first
+REGISTRIES = ["ripencc", "arin", "apnic", "lacnic", "afrinic"]
+
+
+# Parse a country mix like "NO:2,SE:1,US:10"
+def parse_countries(mix):
+    countries = {}
+    for item in mix.split(","):
+        cc, _, weight = item.partition(":")
+        countries[cc.strip().upper()] = float(weight or 1)
+    return countries
+
+
+# Generate SEF lines. Ratios are the relative number of ASN, IPv4 and IPv6
+# records, and nonpow2 the share of IPv4 records with a block size that is
+# not a power of two.
+def generate(
+    records=10000,
+    countries=None,
+    ratios=(40, 45, 15),
+    nonpow2=0.1,
+    registry="ripencc",
+    date="20240301",
+    seed=0,
+):
+    rnd = random.Random(seed)
+    countries = countries or COUNTRIES
+    ccs = sorted(countries)
+    weights = [countries[cc] for cc in ccs]
+    types = rnd.choices(["asn", "ipv4", "ipv6"], weights=ratios, k=records)
+
+    offset = REGISTRIES.index(registry) if registry in REGISTRIES else 0
+    asn = 1 + offset * 10000000
+    ipv4 = int(ipaddress.IPv4Address("1.0.0.0")) + (offset << 28)
+    ipv6 = int(ipaddress.IPv6Address("2001:600::")) + (offset << 116)
+    delegations = {"asn": [], "ipv4": [], "ipv6": []}
+    for rtype in types:
+        cc = rnd.choices(ccs, weights=weights)[0]
+        if rtype == "asn":
+            start, value = asn, rnd.choice((1, 1, 1, 1, 2, 4, 10))
+            asn += value
+        elif rtype == "ipv4":
+            if rnd.random() < nonpow2:
+                value = 256 * rnd.choice((3, 5, 6, 12, 20, 48))
+            else:
+                value = 2 ** rnd.randint(8, 16)
+            start = None  # Placed below
+        else:
+            value = rnd.choice((29, 32, 32, 36, 48))
+            size = 2 ** (128 - value)
+            ipv6 = (ipv6 + size - 1) // size * size  # Align to prefix
+            start = str(ipaddress.IPv6Address(ipv6))
+            ipv6 += size
+        yyyymmdd = (
+            f"{rnd.randint(1994, 2023)}{rnd.randint(1, 12):02d}{rnd.randint(1, 28):02d}"
+        )
+        status = rnd.choice(("allocated", "assigned"))
+        opaque = f"{registry}-{rnd.randint(1, max(1, records // 4)):08d}"
+        delegations[rtype].append([cc, start, value, yyyymmdd, status, opaque])
+
+    # Place IPv4 blocks largest first, each aligned to the prefix the parser
+    # makes of its size (the largest power of two in it), which leaves only
+    # small gaps after blocks that are not a power of two
+    for block in sorted(delegations["ipv4"], key=lambda b: -b[2]):
+        size = 1 << (block[2].bit_length() - 1)
+        ipv4 = (ipv4 + size - 1) // size * size
+        block[1] = str(ipaddress.IPv4Address(ipv4))
+        ipv4 += block[2]
+    for rtype, blocks in delegations.items():
+        delegations[rtype] = [
+            f"{registry}|{cc}|{rtype}|{start}|{value}|{yyyymmdd}|{status}|{opaque}"
+            for cc, start, value, yyyymmdd, status, opaque in blocks
+        ]
+
+    # Some unallocated space, which the parser should skip
+    filler = {
+        "asn": [
+            f"{registry}||asn|{asn + i}|1||reserved|" for i in range(records // 200)
+        ],
+        "ipv4": [
+            f"{registry}||ipv4|{ipaddress.IPv4Address(ipv4 + i * 256)}|256||available|"
+            for i in range(records // 100)
+        ],
+        "ipv6": [],
+    }
+
+    # Summary lines count all records of a type, allocated or not
+    total = records + sum(len(f) for f in filler.values())
+    lines = [
+        f"# Synthetic delegation file, seed {seed}",
+        f"2|{registry}|{date}|{total}|19830705|{date}|+0100",
+    ]
+    for rtype in ("asn", "ipv4", "ipv6"):
+        count = len(delegations[rtype]) + len(filler[rtype])
+        lines.append(f"{registry}|*|{rtype}|*|{count}|summary")
+    for rtype in ("asn", "ipv4", "ipv6"):
+        lines.extend(delegations[rtype])
+    for rtype in ("ipv4", "asn"):
+        lines.extend(filler[rtype])
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic SEF generator")
+    parser.add_argument("-n", dest="records", type=int, default=10000)
+    parser.add_argument("-c", dest="countries", help="Mix, e.g. NO:2,SE:1")
+    parser.add_argument("-r", dest="ratios", default="40:45:15", help="ASN:IPv4:IPv6")
+    parser.add_argument("-p", dest="nonpow2", type=float, default=0.1)
+    parser.add_argument("-R", dest="registry", default="ripencc")
+    parser.add_argument("-d", dest="date", default="20240301")
+    parser.add_argument("-s", dest="seed", type=int, default=0)
+    parser.add_argument("-o", dest="output", help="Output file (default stdout)")
+    args = parser.parse_args()
+
+    lines = generate(
+        args.records,
+        parse_countries(args.countries) if args.countries else None,
+        [float(r) for r in args.ratios.split(":")],
+        args.nonpow2,
+        args.registry,
+        args.date,
+        args.seed,
+    )
+    out = open(args.output, "w") if args.output else sys.stdout
+    out.write("\n".join(lines) + "\n")
@@ -0,0 +1,83 @@
+# Storage backends for the pipeline. The Lambda functions use S3, while local
+# runs (pipeline.py, benchmarks) can use a directory instead. Objects are
+# addressed by bucket and key in both cases.
+
+import os
+import shutil
+
+# Backend used by all functions in this process, created on first use
+_backend = None
+
+
+# S3 storage. boto3 is only imported when the resource is first needed,
+# keeping it out of the cold start when it's not used.
+class S3Storage:
+    def __init__(self, region):
+        self.region = region
+        self._s3 = None
+
+    def s3(self):
+        if self._s3 is None:
+            import boto3
+
+            self._s3 = boto3.resource(service_name="s3", region_name=self.region)
+        return self._s3
+
+    def read(self, bucket, key):
+        return self.s3().Object(bucket, key).get()["Body"].read()
+
+    # Data is a str, bytes or a binary file object
+    def write(self, bucket, key, data):
+        self.s3().Object(bucket, key).put(Body=data)
+
+    def url(self, bucket, key):
+        return f"S3://{bucket}/{key}"
+
+
+# Local directory storage. Objects are stored as <root>/<bucket>/<key>, unless
+# the bucket/key starts with one of the prefixes in paths, which maps a prefix
+# to another directory (e.g. "cc2asn-db/latest" to the legacy server DBDIR).
+class LocalStorage:
+    def __init__(self, root, paths=None):
+        self.root = root
+        self.paths = sorted((paths or {}).items(), key=lambda p: -len(p[0]))
+
+    def path(self, bucket, key):
+        name = f"{bucket}/{key}"
+        for prefix, directory in self.paths:
+            if name.startswith(prefix + "/"):
+                return os.path.join(directory, name[len(prefix) + 1 :])
+        return os.path.join(self.root, bucket, key)
+
+    def read(self, bucket, key):
+        with open(self.path(bucket, key), "rb") as f:
+            return f.read()
+
+    # Data is a str, bytes or a binary file object
+    def write(self, bucket, key, data):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            if isinstance(data, str):
+                f.write(data.encode("utf-8"))
+            elif isinstance(data, bytes):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f)
+
+    def url(self, bucket, key):
+        return f"file://{os.path.abspath(self.path(bucket, key))}"
+
+
+# Get the storage backend. Defaults to S3 in the given region.
+def get(region):
+    global _backend
+    if _backend is None:
+        _backend = S3Storage(region)
+    return _backend
+
+
+# Use another storage backend for the rest of this process
+def use(backend):
+    global _backend
+    _backend = backend
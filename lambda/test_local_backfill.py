@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Backfill dated files from a local HTTP server (with Range support), serving
+# synthetic delegation files. One date is missing, one file is compressed and
+# one download is partial, to be resumed. A missing file for today is not
+# recorded as missing.
+import os
+import sys
+import gzip
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import sefgen
+import downloader
+
+DATES = ["20240301", "20240302", "20240303", "20240305"]  # 20240304 is missing
+ranges = []
+
+
+# Static files, with support for "Range: bytes=<start>-"
+class RangeHandler(SimpleHTTPRequestHandler):
+    def send_head(self):
+        header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if header is None or not os.path.isfile(path):
+            return super().send_head()
+        ranges.append(self.path)
+        start = int(header.split("=")[1].rstrip("-"))
+        size = os.path.getsize(path)
+        if start >= size:
+            self.send_error(416)
+            return None
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        return f
+
+    def log_message(self, *args):
+        pass
+
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    www = os.path.join(tmpdir, "www")
+    dest = os.path.join(tmpdir, "backfill")
+    os.makedirs(www)
+    os.makedirs(dest)
+
+    # Dated fixtures with MD5 sums. The last one is compressed.
+    for i, date in enumerate(DATES):
+        data = "\n".join(sefgen.generate(2000, date=date, seed=i)).encode() + b"\n"
+        fname = f"delegated-ripencc-extended-{date}"
+        if date == DATES[-1]:
+            data, fname = gzip.compress(data), f"{fname}.gz"
+        with open(os.path.join(www, fname), "wb") as f:
+            f.write(data)
+        with open(os.path.join(www, f"{fname}.md5"), "w") as f:
+            f.write(f"MD5 ({fname}) = {hashlib.md5(data).hexdigest()}\n")
+
+    # A partial download of the first date
+    fname = f"delegated-ripencc-extended-{DATES[0]}"
+    with open(os.path.join(www, fname), "rb") as f:
+        half = f.read()[:10000]
+    with open(os.path.join(dest, f"{fname}.part"), "wb") as f:
+        f.write(half)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeHandler, directory=www))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    template = f"http://127.0.0.1:{port}/delegated-{{rir}}-extended-{{date}}"
+
+    downloader.logger.addHandler(logging.StreamHandler(sys.stdout))
+    counts = downloader.backfill("ripencc", DATES[0], "20240304", dest, 2, template)
+    print(counts)
+    assert counts == {"ok": 3, "missing": 1}
+    assert ranges == [f"/{fname}"]
+
+    # The compressed file is decompressed after it's verified
+    counts = downloader.backfill(
+        "ripencc", DATES[0], DATES[-1], dest, 2, template + ".gz"
+    )
+    print(counts)
+    assert counts == {"ok": 1}
+
+    # A missing file for today may still be published, and is retried
+    today = datetime.now(timezone.utc).strftime("%Y%m%d")
+    counts = downloader.backfill("ripencc", today, today, dest, 2, template)
+    assert counts == {"missing": 1}
+
+    with open(os.path.join(dest, ".backfill-ripencc.json")) as f:
+        done = json.load(f)
+    print(done)
+    assert "20240304" in done and today not in done
+    for date in DATES:
+        with open(os.path.join(dest, f"delegated-ripencc-extended-{date}")) as f:
+            assert f.readline().startswith("# Synthetic")
+    print(sorted(os.listdir(dest)))
+    server.shutdown()
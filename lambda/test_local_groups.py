@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Merge, deduplicate and aggregate hand-written records, and check the group
+# files (@EU and @<RIR>) written by the curator to a local directory. Covers
+# overlapping, adjacent and duplicate records, prefixes that are not aligned,
+# and group members that are only in the latest files.
+import os
+import tempfile
+
+import storage
+import ranges
+import curator
+
+# Overlapping, contained and adjacent ranges are merged
+assert ranges.merge([(5, 9), (1, 3), (2, 4), (6, 7), (11, 12)]) == [(1, 9), (11, 12)]
+assert ranges.merge([]) == []
+
+# ASNs are deduplicated and listed one per line, in natural order
+assert ranges.aggregate("ASN", ["AS10", "AS9", "AS10", "AS100"]) == [
+    "AS9",
+    "AS10",
+    "AS100",
+]
+
+# Adjacent and contained prefixes become the fewest covering CIDRs
+ipv4 = ["10.0.1.0/24", "10.0.0.0/24", "10.0.0.128/25", "10.0.0.0/24"]
+assert ranges.aggregate("IPV4", ipv4) == ["10.0.0.0/23"]
+ipv4 = ["10.0.0.0/23", "10.0.2.0/24", "192.0.2.0/24"]
+assert ranges.aggregate("IPV4", ipv4) == ["10.0.0.0/23", "10.0.2.0/24", "192.0.2.0/24"]
+
+# A prefix that is not aligned (e.g. a block of 768 addresses at 10.0.1.0,
+# rounded down to /23 by the parser) is split on its boundaries
+assert ranges.aggregate("IPV4", ["10.0.1.0/23"]) == ["10.0.1.0/24", "10.0.2.0/24"]
+
+ipv6 = ["2001:DB8::/33", "2001:DB8:8000::/33", "2001:DB8:1::/48"]
+assert ranges.aggregate("IPV6", ipv6) == ["2001:DB8::/32"]
+
+
+# Records of a group file
+def group(name):
+    data = store.read(curator.BUCKET, f"latest/{curator.GROUP}{name}").decode()
+    return data.split("\n") if data else []
+
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    storage.use(storage.LocalStorage(tmpdir))
+    store = storage.get(curator.REGION)
+
+    # Merged data of two RIRs, as from pipeline.py
+    ripencc = {
+        "SE": {"ASN": ["AS64500"], "IPV4": ["10.0.0.0/24"]},
+        "DE": {"ASN": ["AS64501", "AS64500"], "IPV4": ["10.0.1.0/24"]},
+        "NO": {"IPV6": ["2001:DB8::/32"]},
+    }
+    arin = {"US": {"ASN": ["AS64600"], "IPV4": ["10.1.0.0/16"]}}
+    ccdata = {"DATE": "20240301", "REGISTRIES": {"RIPENCC": ripencc, "ARIN": arin}}
+    for rirdata in (ripencc, arin):
+        for cc, typedata in rirdata.items():
+            ccdata[cc] = {t: list(r) for t, r in typedata.items()}
+    curator.dbstore(ccdata)
+
+    assert group("EU_ASN") == ["AS64500", "AS64501"]
+    assert group("EU_IPV4") == ["10.0.0.0/23"]
+    assert group("EU_IPV6") == []
+    assert group("EU_ALL") == ["AS64500", "AS64501", "10.0.0.0/23"]
+    assert group("RIPENCC_IPV6") == ["2001:DB8::/32"]
+    assert group("ARIN_ALL") == ["AS64600", "10.1.0.0/16"]
+    assert group("NORDIC_ALL") == ["AS64500", "10.0.0.0/24", "2001:DB8::/32"]
+
+    # Data of a single RIR. Members that are not in the data are read from
+    # their latest files.
+    ccdata = {
+        "DATE": "20240302",
+        "REGISTRY": "RIPENCC",
+        "SE": {"ASN": ["AS64502"], "IPV4": ["10.0.2.0/24"]},
+    }
+    curator.dbstore(ccdata, groups={"EU": curator.GROUPS["EU"], "NA": ["CA", "US"]})
+    assert group("EU_ASN") == ["AS64500", "AS64501", "AS64502"]
+    assert group("EU_IPV4") == ["10.0.1.0/24", "10.0.2.0/24"]
+    assert group("RIPENCC_ASN") == ["AS64502"]
+    assert group("ARIN_ALL") == ["AS64600", "10.1.0.0/16"]
+
+    # A group without members in the data is not written
+    path = os.path.join(tmpdir, curator.BUCKET, "latest")
+    assert not os.path.exists(os.path.join(path, f"{curator.GROUP}NA_ASN"))
+    print("All checks passed")
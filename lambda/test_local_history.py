@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Update the history of a file with random daily changes in a local directory,
+# and check that every date is reconstructed exactly. Covers same day
+# replacement, updates for older dates, unchanged days and both checkpoint
+# triggers (number of deltas and delta size). Files that lose all their
+# records in the curated data are emptied, but only by data of their RIRs.
+import os
+import random
+import tempfile
+from datetime import date, timedelta
+
+import storage
+import history
+import curator
+from history import History
+
+NAME = "NO_IPV4"
+DAYS = 90
+
+rnd = random.Random(0)
+pool = [f"10.{i // 256}.{i % 256}.0/24" for i in range(2000)]
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    storage.use(storage.LocalStorage(tmpdir))
+    hist = History(storage.get("eu-west-1"), "cc2asn-db")
+
+    records = set(rnd.sample(pool, 200))
+    expected = {}  # date -> records
+    day = date(2024, 1, 1)
+    for i in range(DAYS):
+        yyyymmdd = day.strftime("%Y%m%d")
+        if i == 50:
+            # Replace most records, which should force a checkpoint
+            records = set(rnd.sample(pool, 300))
+        elif i % 7 != 3:
+            # Small changes, except on days without any
+            records -= set(rnd.sample(sorted(records), rnd.randint(0, 5)))
+            records |= set(rnd.sample(pool, rnd.randint(0, 5)))
+        hist.update(NAME, yyyymmdd, history.ordered("IPV4", records))
+
+        # Same day replacement
+        if i % 10 == 5:
+            records.add(rnd.choice(pool))
+            hist.update(NAME, yyyymmdd, history.ordered("IPV4", records))
+        expected[yyyymmdd] = set(records)
+        day += timedelta(days=1)
+
+    # An update for an older date is ignored
+    assert hist.update(NAME, "20240110", []) == 0
+
+    entries = hist.index(NAME)
+    kinds = [kind for _, kind, _ in entries]
+    print(f"{len(entries)} entries, {kinds.count('full')} checkpoints")
+    assert kinds[0] == "full"
+    assert entries[[e[0] for e in entries].index("20240220")][1] == "full"
+    runs, run = [], 0
+    for kind in kinds:
+        run = 0 if kind == "full" else run + 1
+        runs.append(run)
+    assert max(runs) == history.CHECKPOINT
+
+    # Unchanged days are not stored, but are seen through the previous date
+    assert len(entries) < DAYS
+    for yyyymmdd, records in expected.items():
+        assert set(hist.view(NAME, yyyymmdd)) == records, yyyymmdd
+    assert hist.view(NAME, "20231231") is None
+    assert set(hist.view(NAME, "20991231")) == expected[max(expected)]
+    assert hist.view(NAME, "20240105") == history.ordered("IPV4", expected["20240105"])
+
+    path = os.path.join(tmpdir, "cc2asn-db", history.PREFIX, NAME)
+    print(f"{len(os.listdir(path))} files, all {len(expected)} dates verified")
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    storage.use(storage.LocalStorage(tmpdir))
+    hist = History(storage.get(curator.REGION), curator.BUCKET)
+
+    ipv4 = ["10.0.0.0/16"]
+    curator.dbstore(
+        {
+            "DATE": "20240301",
+            "REGISTRY": "RIPENCC",
+            "NO": {"IPV4": ipv4, "IPV6": ["2001:DB8::/32"]},
+            "SE": {"ASN": ["AS64500"]},
+        },
+        groups={},
+    )
+    assert hist.tracked() == {n: ["RIPENCC"] for n in ("NO_IPV4", "NO_IPV6", "SE_ASN")}
+
+    # NO_IPV6 and SE are gone the next day
+    data = {"DATE": "20240302", "REGISTRY": "RIPENCC", "NO": {"IPV4": ipv4}}
+    curator.dbstore(data, groups={})
+    assert hist.view("NO_IPV6", "20240301") == ["2001:DB8::/32"]
+    assert hist.view("NO_IPV6", "20240302") == []
+    assert hist.view("SE_ASN", "20240310") == []
+    assert hist.tracked() == {"NO_IPV4": ["RIPENCC"]}
+
+    # Data of another RIR doesn't empty files of RIPENCC
+    data = {"DATE": "20240303", "REGISTRY": "ARIN", "US": {"ASN": ["AS64600"]}}
+    curator.dbstore(data, groups={})
+    assert hist.view("NO_IPV4", "20240303") == ipv4
+    assert hist.tracked() == {"NO_IPV4": ["RIPENCC"], "US_ASN": ["ARIN"]}
+
+    # A file listed by several RIRs is kept while one of them has it
+    data = {
+        "DATE": "20240304",
+        "REGISTRIES": {
+            "ARIN": {"NO": {"IPV4": ipv4}},
+            "RIPENCC": {"NO": {"IPV4": ipv4}},
+        },
+        "NO": {"IPV4": ipv4},
+    }
+    curator.dbstore(data, groups={})
+    assert hist.tracked() == {"NO_IPV4": ["ARIN", "RIPENCC"]}
+    data = {"DATE": "20240305", "REGISTRY": "RIPENCC"}
+    curator.dbstore(data, groups={})
+    assert hist.view("NO_IPV4", "20240305") == ipv4
+    data = {"DATE": "20240306", "REGISTRY": "ARIN"}
+    curator.dbstore(data, groups={})
+    assert hist.view("NO_IPV4", "20240306") == []
+    assert hist.tracked() == {}
+    print("Lost records verified")
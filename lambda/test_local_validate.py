@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# Validate small hand-written delegation files and publish them to a local
+# directory. Covers overlaps hidden by the curated records (ASN blocks and
+# IPv4 blocks that are not a power of two), duplicates, overlaps across RIRs,
+# truncated files, shrinkage, an RIR missing from merged data, and blocked
+# publication in curator.publish().
+import os
+import sys
+import json
+import logging
+import tempfile
+
+os.environ["Limits"] = "overlaps=0,cross=0,duplicates=0,count=0,shrink=0.05"
+
+import storage
+import parser
+import curator
+import pipeline
+from validate import Validator
+
+RIPE = [
+    "ripencc|NO|asn|64500|10|20100101|allocated|a",
+    "ripencc|SE|asn|64520|1|20100101|allocated|b",
+    "ripencc|NO|ipv4|10.0.0.0|768|20100101|allocated|a",
+    "ripencc|SE|ipv4|10.0.4.0|1024|20100101|allocated|b",
+    "ripencc|NO|ipv6|2001:db8::|32|20100101|allocated|a",
+    "ripencc||ipv4|10.0.8.0|256||available|",
+]
+ARIN = [
+    "arin|US|asn|64600|1|20100101|assigned|c",
+    "arin|US|ipv4|10.1.0.0|65536|20100101|allocated|c",
+    "arin|CA|ipv6|2001:db9::|32|20100101|allocated|d",
+]
+
+
+# Delegation file with version and summary lines for the records, plus extra
+# (undeclared) records
+def sef(registry, records, extra=()):
+    types = [r.split("|")[2] for r in records]
+    lines = [f"2|{registry}|20240301|{len(records)}|19830705|20240301|+0100"]
+    for rtype in ("asn", "ipv4", "ipv6"):
+        lines.append(f"{registry}|*|{rtype}|*|{types.count(rtype)}|summary")
+    return parser.parser(lines + records + list(extra))
+
+
+# Merged data of several files, as in pipeline.py
+def merged(*parsed):
+    ccdata = {}
+    for data in parsed:
+        pipeline.merge(ccdata, data)
+    return ccdata
+
+
+def check(ccdata):
+    report = validator.check(json.loads(json.dumps(ccdata)))
+    return {name: count for name, count in report.counts.items() if count}
+
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    storage.use(storage.LocalStorage(tmpdir))
+    validator = Validator(storage.get(curator.REGION), curator.BUCKET)
+    curator.logger.addHandler(logging.StreamHandler(sys.stdout))
+    curator.logger.setLevel(logging.INFO)
+
+    # Valid data
+    assert check(merged(sef("ripencc", RIPE), sef("arin", ARIN))) == {}
+
+    # Overlaps in the tail of an ASN block and a block of 768 addresses
+    # (curated as AS64500 and 10.0.0.0/23)
+    bad = RIPE + [
+        "ripencc|SE|asn|64505|1|20100101|allocated|b",
+        "ripencc|SE|ipv4|10.0.2.0|256|20100101|allocated|b",
+    ]
+    assert check(sef("ripencc", bad)) == {"overlaps": 2}
+
+    # Duplicate, also when listed for another country
+    bad = RIPE + ["ripencc|DK|ipv6|2001:db8::|32|20100101|allocated|b"]
+    assert check(sef("ripencc", bad)) == {"duplicates": 1}
+
+    # Overlap across RIRs
+    bad = ARIN + ["arin|US|ipv4|10.0.4.0|256|20100101|allocated|c"]
+    assert check(merged(sef("ripencc", RIPE), sef("arin", bad))) == {"cross": 1}
+
+    # Truncated file, and records that are not declared
+    lines = [f"2|ripencc|20240301|{len(RIPE)}|19830705|20240301|+0100"]
+    lines += [f"ripencc|*|{t}|*|2|summary" for t in ("asn", "ipv4")]
+    lines += ["ripencc|*|ipv6|*|1|summary"] + RIPE[:3]
+    assert check(parser.parser(lines)) == {"count": 5}
+    extra = ["ripencc|DK|asn|64530|1|20100101|allocated|b"]
+    assert check(sef("ripencc", RIPE, extra)) == {"count": 2}
+
+    # Publish both RIRs
+    assert curator.publish(merged(sef("ripencc", RIPE), sef("arin", ARIN))) > 0
+    snapshot = validator.read("SNAPSHOT_RIPENCC")
+    assert json.loads(snapshot) == {"ASN": 2, "IPV4": 2, "IPV6": 1}
+
+    # Lost records are blocked
+    smaller = [r for r in RIPE if "|SE|" not in r]
+    assert check(merged(sef("ripencc", smaller), sef("arin", ARIN))) == {"shrink": 0.5}
+    assert curator.publish(merged(sef("ripencc", smaller), sef("arin", ARIN))) == 0
+
+    # An RIR missing from merged data (e.g. a failed download) has lost all
+    # its records
+    assert check(merged(sef("ripencc", RIPE))) == {"shrink": 1.0}
+    assert curator.publish(merged(sef("ripencc", RIPE))) == 0
+    assert validator.read("US_ASN").split() == ["AS64600"]
+    assert curator.publish(merged(sef("ripencc", RIPE)), force=True) > 0
+    snapshot = validator.read("SNAPSHOT_ARIN")
+    assert json.loads(snapshot) == {"ASN": 1, "IPV4": 1, "IPV6": 1}
+
+    # The Lambda functions curate one RIR at a time, so other RIRs are not
+    # missing, but are checked against their published @<RIR> files
+    assert check(sef("ripencc", RIPE)) == {}
+    bad = RIPE + ["ripencc|SE|ipv4|10.1.128.0|256|20100101|allocated|b"]
+    assert check(sef("ripencc", bad)) == {"cross": 1}
+    assert curator.publish(sef("ripencc", bad)) == 0
+    assert curator.publish(sef("ripencc", RIPE)) > 0
+    print("All checks passed")
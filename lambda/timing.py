@@ -0,0 +1,92 @@
+# Stage timing and opt-in profiling of the Lambda handlers
+#
+# Profiling is enabled by the Profile environment variable: "cpu" (cProfile),
+# "memory" (tracemalloc) or "all". Results are logged when the profiled
+# block is done.
+
+import os
+import json
+import time
+from contextlib import contextmanager
+
+# Number of entries in profiling reports
+TOP = 25
+
+
+# Collects time spent in each stage, and counts (records, bytes etc.)
+class Timings:
+    def __init__(self, function):
+        self.function = function
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+
+    # Time a stage. Repeated stages are accumulated.
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0) + elapsed
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    # Return as a dictionary, times in seconds
+    def summary(self):
+        return {
+            "function": self.function,
+            "duration": round(time.perf_counter() - self.started, 6),
+            "stages": {k: round(v, 6) for k, v in self.stages.items()},
+            **self.counts,
+        }
+
+    # Log as a single JSON line
+    def log(self, logger):
+        logger.info(json.dumps(self.summary()))
+
+
+# Profile the block with cProfile and/or tracemalloc, if enabled
+@contextmanager
+def profiled(logger):
+    modes = set(os.getenv("Profile", default="").lower().split(","))
+    cpu = bool(modes & {"cpu", "all"})
+    memory = bool(modes & {"memory", "all"})
+
+    # The profilers are only imported when enabled, keeping them out of the
+    # cold start
+    if cpu or memory:
+        import io
+        import pstats
+        import cProfile
+        import tracemalloc
+
+    profiler = None
+    if cpu:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if memory:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if memory:
+            # Leave out allocations made by the profilers themselves
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, cProfile.__file__),
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                ]
+            )
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            top = "\n".join(str(s) for s in snapshot.statistics("lineno")[:TOP])
+            logger.info(f"tracemalloc: current={current} peak={peak}\n{top}")
+        if profiler is not None:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(TOP)
+            logger.info(f"cProfile:\n{out.getvalue()}")
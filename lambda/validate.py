@@ -0,0 +1,231 @@
+# Integrity check of parsed delegation data before it is published. Checks for
+#
+#   overlaps    records of an RIR covering the same addresses or ASNs
+#   cross       records of different RIRs covering the same addresses or ASNs
+#   duplicates  records listed more than once by an RIR
+#   count       record lines that differ from the version and summary lines
+#               (e.g. a truncated file)
+#   shrink      records lost since the previous snapshot, as a fraction. An
+#               RIR missing from merged data has lost all its records.
+#
+# Overlaps are found with a sweep over the integer ranges of the records
+# (from their SEF start and value), sorted by start, so the check is
+# O(n log n). Publication is blocked when a check exceeds its limit. RIRs that
+# are not in the data (when the Lambda functions curate one at a time) are
+# checked against their latest @<RIR> group files, and the record counts of
+# each RIR are stored in latest/SNAPSHOT_<RIR> when the data is published.
+
+import os
+import json
+
+import ranges
+
+PREFIX = "SNAPSHOT"  # File name prefix
+REGISTRIES = ["AFRINIC", "APNIC", "ARIN", "LACNIC", "RIPENCC"]
+RECTYPES = ["ASN", "IPV4", "IPV6"]
+EXAMPLES = 10  # Max number of problems logged for each check
+
+# Default limits. Override with the Limits environment variable, e.g.
+# "overlaps=0,shrink=0.1".
+LIMITS = {"overlaps": 10, "cross": 100, "duplicates": 10, "count": 0, "shrink": 0.05}
+
+
+# Parse limits like "overlaps=0,shrink=0.1"
+def read_limits(text):
+    limits = dict(LIMITS)
+    for item in text.split(","):
+        name, _, value = item.partition("=")
+        if name.strip():
+            limits[name.strip().lower()] = float(value)
+    return limits
+
+
+# Limits from the environment, or the defaults
+def get_limits():
+    text = os.getenv("Limits")
+    return read_limits(text) if text else LIMITS
+
+
+# SEF start and value of a curated record (e.g. "AS64500" or "10.0.0.0/8")
+def sef(rectype, record):
+    if rectype == "ASN":
+        return record[2:], "1"
+    start, length = record.split("/")
+    if rectype == "IPV4":
+        return start, str(1 << (32 - int(length)))
+    return start, length
+
+
+# Record ranges of each registry ({registry: {rectype: ["cc|start|value"]}})
+# in parsed or merged data. Data without them (parsed by an older parser) is
+# converted from the records, where countries are the keys of up to two
+# letters.
+def extents(ccdata):
+    if "RANGES" in ccdata:
+        return ccdata["RANGES"]
+    data = ccdata.get("REGISTRIES")
+    if data is None:
+        countries = {cc: d for cc, d in ccdata.items() if len(cc) <= 2}
+        data = {ccdata.get("REGISTRY", ""): countries}
+    converted = {}
+    for registry, countries in data.items():
+        typedata = converted.setdefault(registry, {})
+        for cc, records in countries.items():
+            for rectype, recs in records.items():
+                if rectype in RECTYPES:
+                    typedata.setdefault(rectype, []).extend(
+                        "|".join((cc, *sef(rectype, r))) for r in recs
+                    )
+    return converted
+
+
+# Readable form of a SEF start and value
+def label(rectype, start, value):
+    if rectype == "ASN":
+        return f"AS{start}" if value == "1" else f"AS{start}+{value}"
+    if rectype == "IPV4":
+        size = int(value)
+        if size & (size - 1):
+            return f"{start}+{value}"
+        return f"{start}/{33 - size.bit_length()}"
+    return f"{start}/{value}"
+
+
+# Pairs of overlapping ranges, each (start, end, *tag). Ranges are swept in
+# order of start, and each range that starts before the end of the range
+# reaching furthest so far is paired with that range.
+def overlaps(spans):
+    pairs = []
+    reach = None
+    for span in sorted(spans):
+        if reach is not None and span[0] <= reach[1]:
+            pairs.append((reach, span))
+        if reach is None or span[1] > reach[1]:
+            reach = span
+    return pairs
+
+
+# Result of a check
+class Report:
+    def __init__(self, limits):
+        self.limits = limits
+        self.counts = {name: 0 for name in limits}
+        self.problems = {name: [] for name in limits}
+        self.snapshot = {}  # registry -> {rectype: records}
+
+    def add(self, name, problem, count=1):
+        self.counts[name] += count
+        self.problems[name].append(problem)
+
+    # Checks that exceed their limit
+    def blocked(self):
+        return [n for n, c in self.counts.items() if c > self.limits[n]]
+
+    def log(self, logger):
+        for name, problems in self.problems.items():
+            for problem in problems[:EXAMPLES]:
+                logger.warning(f"{name}: {problem}")
+            if len(problems) > EXAMPLES:
+                logger.warning(f"{name}: {len(problems) - EXAMPLES} more")
+        logger.info(json.dumps({"validation": self.counts}))
+
+
+class Validator:
+    def __init__(self, store, bucket, limits=None):
+        self.store = store
+        self.bucket = bucket
+        self.limits = get_limits() if limits is None else limits
+
+    # Read a file from latest/, or None if it doesn't exist
+    def read(self, filename):
+        try:
+            return self.store.read(self.bucket, f"latest/{filename}").decode()
+        except Exception:
+            return None
+
+    # Check parsed (or merged) data, returning a report
+    def check(self, ccdata):
+        report = Report(self.limits)
+        data = extents(ccdata)
+        self.check_counts(report, ccdata.get("COUNTS", {}))
+
+        spans = {rectype: [] for rectype in RECTYPES}  # (start, end, registry, key)
+        where = {}  # (registry, rectype) -> {(start, value): cc}
+        for registry, typedata in data.items():
+            report.snapshot[registry] = {}
+            for rectype in RECTYPES:
+                seen = {}
+                for entry in typedata.get(rectype, []):
+                    cc, start, value = entry.split("|")
+                    key = (start, value)
+                    if key in seen:
+                        problem = f"{registry} {label(rectype, *key)} ({cc})"
+                        report.add("duplicates", problem)
+                    seen[key] = cc
+                spans[rectype] += [
+                    (*ranges.extent(rectype, *key), registry, key) for key in seen
+                ]
+                where[(registry, rectype)] = seen
+                report.snapshot[registry][rectype] = len(seen)
+
+        # RIRs not in the data, as last published
+        others = [] if "" in data else [r for r in REGISTRIES if r not in data]
+        for registry in others:
+            for rectype in RECTYPES:
+                group = (self.read(f"@{registry}_{rectype}") or "").split()
+                seen = {sef(rectype, r): f"@{registry}" for r in group}
+                spans[rectype] += [
+                    (*ranges.extent(rectype, *key), registry, key) for key in seen
+                ]
+                where[(registry, rectype)] = seen
+
+        for rectype, typespans in spans.items():
+            for a, b in overlaps(typespans):
+                name = "overlaps" if a[2] == b[2] else "cross"
+                acc = where[(a[2], rectype)][a[3]]
+                bcc = where[(b[2], rectype)][b[3]]
+                report.add(
+                    name,
+                    f"{a[2]} {label(rectype, *a[3])} ({acc}) and "
+                    f"{b[2]} {label(rectype, *b[3])} ({bcc})",
+                )
+
+        self.check_shrink(report, "REGISTRIES" in ccdata)
+        return report
+
+    # Compare the records seen with the declared number of records
+    def check_counts(self, report, counts):
+        for registry, count in counts.items():
+            for key, declared in count["declared"].items():
+                seen = count["seen"].get(key, 0)
+                if seen != declared:
+                    report.add(
+                        "count",
+                        f"{registry} {key}: {seen} records, {declared} declared",
+                        abs(declared - seen),
+                    )
+
+    # Compare the number of records with the previous snapshot. Merged data
+    # is expected to hold all RIRs that have been published before.
+    def check_shrink(self, report, merged):
+        registries = REGISTRIES if merged else report.snapshot
+        for registry in registries:
+            previous = self.read(f"{PREFIX}_{registry}")
+            if previous is None:
+                continue
+            snapshot = report.snapshot.get(registry, {})
+            for rectype, count in json.loads(previous).items():
+                current = snapshot.get(rectype, 0)
+                if count and current < count:
+                    shrink = round((count - current) / count, 4)
+                    report.counts["shrink"] = max(report.counts["shrink"], shrink)
+                    if shrink > report.limits["shrink"]:
+                        problem = f"{registry} {rectype}: {count} -> {current} records"
+                        report.problems["shrink"].append(problem)
+
+    # Store the record counts of a published report
+    def save(self, report):
+        for registry, snapshot in report.snapshot.items():
+            if registry:
+                key = f"latest/{PREFIX}_{registry}"
+                self.store.write(self.bucket, key, json.dumps(snapshot))
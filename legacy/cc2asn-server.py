@@ -9,8 +9,11 @@ ISO-3166-1 alpha-2 country code (e.g. NO for Norway). The server
 will respond back with the list of registered AS-numbers.
 Optionally a record type (IPv4, IPv6 or ALL) may be specified to
 get prefixes instead of ASNs, or to get everything that is
-registered for this country. Logs all system messages and client
-queries to local syslog.
+registered for this country. Several queries may be sent on one
+connection, either newline delimited or as a comma separated list of
+country codes, in which case each reply is framed as
+"OK <type> <cc> <length>" followed by the data (or "ERR ..." on
+failure). Logs all system messages and client queries to local syslog.
 
 
 Author: Tor Inge Skaar
@@ -24,68 +27,214 @@ import sys
 import pwd
 import grp
 import errno
+import time
+import bisect
+import binascii
+import json
 import signal
+import select
+import socket
 import argparse
-import datetime
 import configobj
 import threading
+import collections
 import SocketServer
 import logging
 from logging.handlers import SysLogHandler
 
+# Valid query: optional date (ASOF YYYY-MM-DD), optional record type and one
+# or more comma separated ISO-3166-1 alpha-2 country codes or @groups (e.g.
+# "NO", "IPV4 SE", "ALL NO,SE,DK", "IPV4 @EU" or "ASOF 2024-03-01 IPV4 NO")
+NAME = '(?:[A-Z]{2}|@[A-Z0-9]+)'
+QUERY = re.compile('^(?:ASOF (\\d{4}-?\\d{2}-?\\d{2}) )?'
+                   '(?:(ALL|ASN|IPV4|IPV6) )?'
+                   '(' + NAME + '(?: ?, ?' + NAME + ')*)$')
+
+# Holder query: all resources held by the holder of an ASN or prefix
+HOLDER = re.compile('^HOLDER ((?:AS)?\\d+|[0-9A-F.:]+/\\d+)$')
+
+# Max length of a single query line
+MAXLINE = 256
+
 
 # Each time a client connect, a new instance of this class is created.
 class RequestHandler(SocketServer.BaseRequestHandler):
 
+    # Count active connections
+    def setup(self):
+        self.server.metrics.connect()
+        self.ended = True  # Whether the last data sent ended with a newline
+
+    def finish(self):
+        self.server.metrics.disconnect()
+
     # Handle the incomming request
     def handle(self):
 
-        # Receive 8 bytes of data, and convert to uppercase
+        # Client IP
+        client = self.client_address[0]
+
+        # Don't let idle clients hold on to a thread forever
+        self.request.settimeout(self.server.clienttimeout)
+
+        # Receive the first chunk of data
+        sockdata = self.receive()
+        if not sockdata:
+            self.server.logger.warning('No client data received')
+            return
+
+        # A single query (with or without newline) is answered unframed,
+        # exactly like before. Framed replies are explicit: a BATCH line, a
+        # comma separated list or several lines in the first chunk.
+        lines = sockdata.split('\n')
+        if len(lines) == 1 or (len(lines) == 2 and not lines[1].strip()):
+            query = lines[0].strip().upper()
+            if query != 'BATCH':
+                queries = self.parse(client, query)
+                if queries is not None:
+                    self.respond(client, queries, len(queries) > 1)
+                self.unframed(client)
+                return
+        self.batch(client, lines)
+        return
+
+    # Refuse queries that are already pending after an unframed reply,
+    # instead of dropping them silently when the connection is closed. Only
+    # data that has arrived is checked, so the reply is never delayed.
+    def unframed(self, client):
         try:
-            sockdata = self.request.recv(8)
+            pending = select.select([self.request], [], [], 0)[0]
+        except (select.error, IOError):
+            return
+        sockdata = self.receive() if pending else None
+        if sockdata and sockdata.strip():
+            self.server.logger.warning('Client ' + client +
+                                       ' sent queries without BATCH')
+            self.server.metrics.error('unframed')
+            self.send(('' if self.ended else '\n') +
+                      'ERR - send BATCH first for several queries\n')
+
+    # Receive a chunk of data from the client, or None on timeout/reset
+    def receive(self):
+        try:
+            return self.request.recv(4096)
+        except socket.timeout:
+            return None
         except IOError as e:
             if e.errno == errno.ECONNRESET:
                 self.server.logger.warning('Connection reset by client')
-                return
+                return None
             else:
                 raise
-        if sockdata is not None:
-            sockdata = sockdata.strip().upper()
-        else:
-            self.server.logger.warning('No client data received')
-            return
-
-        # Client IP
-        client = self.client_address[0]
 
-        # First match cc search without rectype
-        ccmatch = re.match('^([A-Z]{2})$', sockdata)
-        if ccmatch is not None:
-            # Defaulting to ASN
-            rectype = 'ASN'
-            cc = ccmatch.group(1)
-        else:
-            # Check if record type is defined
-            recmatch = re.match('^(ALL|ASN|IPV4|IPV6) ([A-Z]{2})$', sockdata)
-            if recmatch is not None:
-                rectype = recmatch.group(1)
-                cc = recmatch.group(2)
-            else:
-                self.server.logger.error('Invalid query from ' + client +
-                                         ': ' + str(sockdata))
+    # Process newline delimited queries until the client is done. Replies
+    # are framed and streamed back in the same order as the queries.
+    def batch(self, client, lines):
+        buffered = lines.pop()
+        count = 0
+        while True:
+            for line in lines:
+                query = line.strip().upper()
+                if query in ('', 'END', 'QUIT'):
+                    return
+                if query == 'BATCH':
+                    continue
+                count += 1
+                if count > self.server.maxqueries:
+                    self.server.logger.warning('Client ' + client +
+                                               ' exceeded max queries')
+                    self.server.metrics.error('toomany')
+                    self.send('ERR - too many queries\n')
+                    return
+                queries = self.parse(client, query)
+                if queries is None:
+                    self.send('ERR - invalid query\n')
+                    continue
+                self.respond(client, queries, True)
+
+            # Wait for more queries
+            if len(buffered) > MAXLINE:
+                self.server.logger.error('Query line too long from ' + client)
+                self.server.metrics.error('toolong')
+                self.send('ERR - query too long\n')
                 return
-
-        # Construct path to file and send the contents to client
+            sockdata = self.receive()
+            if not sockdata:
+                # Client closed (or went idle). Answer any unterminated query.
+                if buffered.strip():
+                    lines, buffered = [buffered], ''
+                    continue
+                return
+            lines = (buffered + sockdata).split('\n')
+            buffered = lines.pop()
+
+    # Parse a query into a list of (rectype, cc, date) tuples, where date
+    # is None for current data. For holder queries, rectype is HOLDER and
+    # cc the resource. Returns None if the query is invalid.
+    def parse(self, client, query):
+        holder = HOLDER.match(query)
+        if holder is not None:
+            return [('HOLDER', holder.group(1), None)]
+
+        match = QUERY.match(query)
+        date = None
+        if match is not None and match.group(1) is not None:
+            date = match.group(1).replace('-', '')
+            try:
+                time.strptime(date, '%Y%m%d')
+            except ValueError:
+                match = None
+        if match is None:
+            self.server.logger.error('Invalid query from ' + client +
+                                     ': ' + str(query))
+            self.server.metrics.error('invalid')
+            return None
+
+        # Defaulting to ASN
+        rectype = match.group(2) or 'ASN'
+        return [(rectype, cc.strip(), date)
+                for cc in match.group(3).split(',')]
+
+    # Look up and send the data for each query to the client
+    def respond(self, client, queries, framed):
+        for rectype, cc, date in queries:
+            start = time.time()
+            if rectype == 'HOLDER':
+                data = self.server.holders.lookup(cc)
+            elif date is None:
+                data = self.lookup(client, rectype, cc)
+            else:
+                data = self.server.history.lookup(rectype, cc, date)
+            if data is None:
+                self.server.metrics.error('missing')
+                if framed:
+                    self.send('ERR {} {} not found\n'.format(rectype, cc))
+                continue
+            if framed:
+                self.send('OK {} {} {}\n'.format(rectype, cc, len(data)))
+            self.send(data)
+            self.server.metrics.query(rectype, cc if rectype != 'HOLDER'
+                                      else None, time.time() - start)
+            if date is not None:
+                rectype = 'ASOF {} {}'.format(date, rectype)
+            self.logclient(client, rectype, cc)
+
+    # Construct path to file and return its contents
+    def lookup(self, client, rectype, cc):
         datafile = cc + '_' + rectype
         datapath = os.path.join(self.server.config.get('DBDIR'), datafile)
         if os.path.isfile(datapath) and os.access(datapath, os.R_OK):
             with open(datapath, 'r') as data:
-                self.request.send(data.read())
-                self.logclient(client, rectype, cc)
-        else:
-            self.server.logger.warning('Client ' + client +
-                                       ' queried for missing file: '+datapath)
-        return
+                return data.read()
+        self.server.logger.warning('Client ' + client +
+                                   ' queried for missing file: '+datapath)
+        return None
+
+    # Send all data to client
+    def send(self, data):
+        self.request.sendall(data)
+        self.ended = data.endswith('\n')
+        self.server.metrics.sent(len(data))
 
     # Log client requests
     def logclient(self, ip, rectype, cc):
@@ -93,11 +242,467 @@ class RequestHandler(SocketServer.BaseRequestHandler):
             # Use syslog
             self.server.logger.info('Query: ' + ip + ' ' + rectype + ' ' + cc)
         else:
-            # Use custom log
-            now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log = open(self.server.clientlog, 'a')
-            log.write('{} {} {} {}\n'.format(now, ip, rectype, cc))
-            log.close()
+            # Use custom log (written by a separate thread)
+            self.server.clientlog.write(ip, rectype, cc)
+# End class
+
+
+# Natural sort key, e.g. AS9 before AS10 and 9.0.0.0/8 before 10.0.0.0/8
+def natkey(record):
+    return [int(s) if s.isdigit() else s for s in re.split('(\\d+)', record)]
+
+
+# Curated files as they were on a given date, reconstructed from checkpoints
+# and deltas in HISTDIR (see lambda/history.py for the format)
+class History(object):
+
+    def __init__(self, histdir):
+        self.histdir = histdir
+
+    # Read a history file, or None if it doesn't exist
+    def read(self, name, filename):
+        path = os.path.join(self.histdir, name, filename)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as f:
+            return f.read()
+
+    # A checkpoint or delta listed in the index is missing, so the records
+    # can't be reconstructed (the query is answered as not found)
+    def missing(self, name, filename):
+        logger.warning('Missing history file: ' +
+                       os.path.join(self.histdir, name, filename))
+        return None
+
+    # Records of a file (e.g. NO_IPV4) on date (YYYYMMDD), or None
+    def view(self, name, date):
+        index = self.read(name, 'index')
+        if not index:
+            return None
+        entries = [line.split()[:2] for line in index.splitlines()]
+        end = bisect.bisect_right([e[0] for e in entries], date)
+        if end == 0:
+            return None
+
+        # Start from the last checkpoint and apply the following deltas
+        start = end - 1
+        while entries[start][1] != 'full':
+            start -= 1
+        full = self.read(name, entries[start][0] + '.full')
+        if full is None:
+            return self.missing(name, entries[start][0] + '.full')
+        records = set(full.splitlines())
+        for entry in entries[start + 1:end]:
+            delta = self.read(name, entry[0] + '.delta')
+            if delta is None:
+                return self.missing(name, entry[0] + '.delta')
+            for line in delta.splitlines():
+                if line.startswith('+'):
+                    records.add(line[1:])
+                else:
+                    records.discard(line[1:])
+        records.discard('')
+        if name.endswith('_IPV6'):
+            return sorted(records)
+        return sorted(records, key=natkey)
+
+    # Data for rectype and country on date, or None if there is no history
+    def lookup(self, rectype, cc, date):
+        if self.histdir is None:
+            return None
+        if rectype == 'ALL':
+            views = [self.view(cc + '_' + t, date)
+                     for t in ('ASN', 'IPV4', 'IPV6')]
+            if all(v is None for v in views):
+                return None
+            records = [r for v in views if v is not None for r in v]
+        else:
+            records = self.view(cc + '_' + rectype, date)
+            if records is None:
+                return None
+        # Without a trailing newline, exactly like the latest files
+        return '\n'.join(records)
+# End class
+
+
+# Index of resources by holder, loaded from the HOLDERS_<REGISTRY> files in
+# DBDIR (written by the curator), and reloaded when they change
+class Holders(object):
+
+    # Seconds between checks for changed index files
+    CHECK = 60
+
+    def __init__(self, dbdir):
+        self.dbdir = dbdir
+        self.lock = threading.Lock()
+        self.checked = 0
+        self.mtimes = None
+        self.holders = {}    # (registry, opaque-id) -> [record|cc|status]
+        self.resources = {}  # record -> (registry, opaque-id)
+
+    # Modification times of the index files
+    def stat(self):
+        mtimes = {}
+        for filename in os.listdir(self.dbdir):
+            if filename.startswith('HOLDERS_'):
+                path = os.path.join(self.dbdir, filename)
+                mtimes[path] = os.path.getmtime(path)
+        return mtimes
+
+    # (Re)load the index files if they have changed
+    def load(self):
+        if time.time() - self.checked < self.CHECK:
+            return
+        self.checked = time.time()
+        mtimes = self.stat()
+        if mtimes == self.mtimes:
+            return
+        with self.lock:
+            if mtimes == self.mtimes:
+                return
+            holders, resources = {}, {}
+            for path in mtimes:
+                registry = os.path.basename(path)[len('HOLDERS_'):]
+                with open(path, 'r') as f:
+                    ids = json.load(f)
+                for opaque, entries in ids.items():
+                    holder = (registry, opaque)
+                    holders[holder] = [str(e) for e in entries]
+                    for entry in holders[holder]:
+                        resources[entry.split('|', 1)[0]] = holder
+            self.holders, self.resources = holders, resources
+            self.mtimes = mtimes
+            logger.info('Loaded {} holders from {} index files'
+                        .format(len(holders), len(mtimes)))
+
+    # All resources held by the holder of resource, or None
+    def lookup(self, resource):
+        if resource.isdigit():
+            resource = 'AS' + resource
+        self.load()
+        holder = self.resources.get(resource)
+        if holder is None:
+            return None
+        records = [e.split('|', 1)[0] for e in self.holders[holder]]
+        # ASNs first, then IPv4 and IPv6 prefixes
+        records.sort(key=lambda r: (not r.startswith('AS'), ':' in r,
+                                    natkey(r)))
+        return '\n'.join(records)
+# End class
+
+
+# Query metrics. All updates share one lock that is only held for the
+# increment itself. Exported in Prometheus text format.
+class Metrics(object):
+
+    # Upper bounds (seconds) of the latency histogram buckets
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+               0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.connections = 0
+        self.active = 0
+        self.bytes = 0
+        self.rectypes = collections.Counter()
+        self.countries = collections.Counter()
+        self.errors = collections.Counter()
+        self.latency = {}  # rectype -> [bucket counts..., sum]
+
+    def connect(self):
+        with self.lock:
+            self.connections += 1
+            self.active += 1
+
+    def disconnect(self):
+        with self.lock:
+            self.active -= 1
+
+    def sent(self, nbytes):
+        with self.lock:
+            self.bytes += nbytes
+
+    def error(self, reason):
+        with self.lock:
+            self.errors[reason] += 1
+
+    # Record a successful query and its latency
+    def query(self, rectype, cc, seconds):
+        i = bisect.bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            self.rectypes[rectype] += 1
+            if cc is not None:
+                self.countries[cc] += 1
+            hist = self.latency.get(rectype)
+            if hist is None:
+                hist = self.latency[rectype] = [0] * (len(self.BUCKETS) + 2)
+            hist[i] += 1
+            hist[-1] += seconds
+
+    # Return all metrics in Prometheus text exposition format
+    def export(self):
+        with self.lock:
+            connections, active, nbytes = (self.connections, self.active,
+                                           self.bytes)
+            rectypes = dict(self.rectypes)
+            countries = dict(self.countries)
+            errors = dict(self.errors)
+            latency = dict((k, list(v)) for k, v in self.latency.items())
+
+        out = []
+
+        def metric(name, mtype, helptext, samples):
+            out.append('# HELP {} {}'.format(name, helptext))
+            out.append('# TYPE {} {}'.format(name, mtype))
+            for labels, value in samples:
+                out.append('{}{} {}'.format(name, labels, value))
+
+        metric('cc2asn_uptime_seconds', 'gauge', 'Seconds since start',
+               [('', '{:.0f}'.format(time.time() - self.started))])
+        metric('cc2asn_connections_total', 'counter', 'Client connections',
+               [('', connections)])
+        metric('cc2asn_connections_active', 'gauge', 'Open connections',
+               [('', active)])
+        metric('cc2asn_sent_bytes_total', 'counter', 'Bytes sent to clients',
+               [('', nbytes)])
+        metric('cc2asn_queries_total', 'counter', 'Queries by record type',
+               [('{{rectype="{}"}}'.format(k), v)
+                for k, v in sorted(rectypes.items())])
+        metric('cc2asn_country_queries_total', 'counter',
+               'Queries by country code',
+               [('{{cc="{}"}}'.format(k), v)
+                for k, v in sorted(countries.items())])
+        metric('cc2asn_errors_total', 'counter',
+               'Failed queries by reason',
+               [('{{reason="{}"}}'.format(k), v)
+                for k, v in sorted(errors.items())])
+
+        samples = []
+        for rectype, hist in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), hist[:-1]):
+                cumulative += count
+                samples.append(('_bucket{{rectype="{}",le="{}"}}'
+                                .format(rectype, bound), cumulative))
+            samples.append(('_sum{{rectype="{}"}}'.format(rectype),
+                            '{:.6f}'.format(hist[-1])))
+            samples.append(('_count{{rectype="{}"}}'.format(rectype),
+                            cumulative))
+        metric('cc2asn_query_latency_seconds', 'histogram',
+               'Query latency by record type', samples)
+
+        return '\n'.join(out) + '\n'
+
+    # Periodically write metrics to file (for the node exporter textfile
+    # collector). Written to a temp file first, so readers never see a
+    # partial file.
+    def dump(self, path, interval):
+        while True:
+            tmpfile = path + '.tmp'
+            try:
+                with open(tmpfile, 'w') as f:
+                    f.write(self.export())
+                os.rename(tmpfile, path)
+            except (IOError, OSError) as e:
+                logger.error('Failed to write metrics: {}'.format(e))
+            time.sleep(interval)
+# End class
+
+
+# Token bucket rate limiter keyed by client prefix. Only tracks the
+# `maxclients` most recently seen prefixes (LRU). Not thread safe, as it is
+# only used from the main server thread.
+class RateLimiter(object):
+
+    def __init__(self, rate, burst, prefix4=32, prefix6=64, maxclients=65536):
+        self.rate = float(rate)  # Tokens (connections) added per second
+        self.burst = burst       # Bucket size
+        self.prefix4 = prefix4
+        self.prefix6 = prefix6
+        self.maxclients = maxclients
+        self.buckets = collections.OrderedDict()  # key -> (tokens, updated)
+
+    # Map client IP to its prefix
+    def key(self, ip):
+        if ':' in ip:
+            packed = socket.inet_pton(socket.AF_INET6, ip)
+            bits = self.prefix6
+        else:
+            packed = socket.inet_aton(ip)
+            bits = self.prefix4
+        addr = int(binascii.hexlify(packed), 16)
+        return (len(packed), addr >> (len(packed) * 8 - bits))
+
+    # Take a token from the client's bucket. Returns False if it is empty.
+    def allow(self, ip):
+        key = self.key(ip)
+        now = time.time()
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            tokens = self.burst
+            if len(self.buckets) >= self.maxclients:
+                self.buckets.popitem(last=False)
+        else:
+            tokens, updated = bucket
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now)
+        return allowed
+# End class
+
+
+# Threaded TCP server that rejects abusive clients and caps the number of
+# concurrent connections before a handler thread is spawned
+class Server(SocketServer.ThreadingTCPServer):
+
+    # Listen backlog (default of 5 drops connections under concurrent load)
+    request_queue_size = 128
+
+    limiter = None
+    slots = None
+
+    # Called from the main thread for every new connection
+    def verify_request(self, request, client_address):
+        reason = None
+        if (self.limiter is not None and
+                not self.limiter.allow(client_address[0])):
+            reason = 'ratelimited'
+        elif self.slots is not None and not self.slots.acquire(False):
+            reason = 'overloaded'
+        if reason is None:
+            return True
+        self.metrics.error(reason)
+        try:
+            request.send('ERR - {}\n'.format(reason))
+        except (socket.error, IOError):
+            pass
+        return False
+
+    # Release connection slot when the handler thread is done
+    def process_request_thread(self, request, client_address):
+        try:
+            SocketServer.ThreadingTCPServer.process_request_thread(
+                self, request, client_address)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+# End class
+
+
+# Answer STATS queries on the local stats port
+class StatsHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        self.request.settimeout(self.server.clienttimeout)
+        try:
+            sockdata = self.request.recv(64)
+        except (socket.timeout, IOError):
+            return
+        if sockdata.strip().upper() == 'STATS':
+            self.request.sendall(self.server.metrics.export())
+# End class
+
+
+# Client log written in batches by a single writer thread. Request handlers
+# only append records to a deque (atomic, no locking), so logging adds no
+# latency to the reply path.
+class ClientLog(object):
+
+    def __init__(self, path, flush=1, sync=10, maxsize=0, maxage=0,
+                 backups=5):
+        self.path = path
+        self.flush = flush      # Seconds between each write of queued records
+        self.sync = sync        # Seconds between each fsync
+        self.maxsize = maxsize  # Rotate when file exceeds this size (bytes)
+        self.maxage = maxage    # Rotate when file is older than this (seconds)
+        self.backups = backups  # Number of rotated files to keep
+        self.records = collections.deque()
+        self.stopped = threading.Event()
+        self.logfile = None
+        self.opened = 0
+        self.synced = 0
+        self.thread = threading.Thread(target=self.run, name='ClientLog')
+        self.thread.daemon = True
+
+    # Queue a client request
+    def write(self, ip, rectype, cc):
+        self.records.append((time.time(), ip, rectype, cc))
+
+    # Start the writer thread
+    def start(self):
+        self.open()
+        self.thread.start()
+
+    # Write remaining records and stop the writer thread
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+    # Writer thread main loop
+    def run(self):
+        while not self.stopped.is_set():
+            self.stopped.wait(self.flush)
+            try:
+                self.drain()
+            except (IOError, OSError) as e:
+                logger.error('Failed to write client log: {}'.format(e))
+        try:
+            self.drain()
+            self.fsync()
+        except (IOError, OSError) as e:
+            logger.error('Failed to write client log: {}'.format(e))
+        self.logfile.close()
+
+    # Write all queued records in one go
+    def drain(self):
+        lines = []
+        while self.records:
+            ts, ip, rectype, cc = self.records.popleft()
+            now = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+            lines.append('{} {} {} {}\n'.format(now, ip, rectype, cc))
+        if lines:
+            self.logfile.write(''.join(lines))
+            self.logfile.flush()
+        if time.time() - self.synced >= self.sync:
+            self.fsync()
+        if self.expired():
+            self.rotate()
+
+    # Force written records to disk
+    def fsync(self):
+        os.fsync(self.logfile.fileno())
+        self.synced = time.time()
+
+    # Check if the log file is due for rotation
+    def expired(self):
+        if self.maxsize and self.logfile.tell() >= self.maxsize:
+            return True
+        if self.maxage and time.time() - self.opened >= self.maxage:
+            return True
+        return False
+
+    # Rotate log files: log -> log.1 -> log.2 ... -> log.<backups>
+    def rotate(self):
+        self.fsync()
+        self.logfile.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = '{}.{}'.format(self.path, i)
+            if os.path.exists(src):
+                os.rename(src, '{}.{}'.format(self.path, i + 1))
+        if self.backups > 0:
+            os.rename(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.open()
+        logger.info('Rotated client log: {}'.format(self.path))
+
+    # Open log file for appending
+    def open(self):
+        self.logfile = open(self.path, 'a')
+        self.opened = time.time()
 # End class
 
 
@@ -251,6 +856,10 @@ def shutdown_handler(event):
     except Exception as e:
         logger.error('Failed: {}'.format(e.strerror))
 
+    # Write any queued client log records
+    if server.clientlog is not None:
+        server.clientlog.close()
+
     # Remove pid file
     try:
         # was config.get(pidfile)
@@ -299,7 +908,7 @@ if __name__ == '__main__':
     # Create a threaded TCP server, spawning separate threats for each client
     listen = int(config.get('PORT'))
     try:
-        server = SocketServer.ThreadingTCPServer(('', listen), RequestHandler)
+        server = Server(('', listen), RequestHandler)
         (ip, port) = server.server_address
         logger.info('Server bound to {}:{}'.format(ip, port))
     except IOError as e:
@@ -310,10 +919,42 @@ if __name__ == '__main__':
         logger.critical(errmsg)
         exit(errmsg)
 
+    # Create a local server for STATS queries
+    statsport = int(config.get('STATSPORT', 0))
+    if statsport:
+        try:
+            stats = SocketServer.ThreadingTCPServer(('127.0.0.1', statsport),
+                                                    StatsHandler)
+            logger.info('Stats server bound to 127.0.0.1:{}'
+                        .format(statsport))
+        except IOError as e:
+            errmsg = 'Failed to bind stats port {}: {}'.format(statsport,
+                                                               e.strerror)
+            logger.critical(errmsg)
+            exit(errmsg)
+
     # Share variables with server
-    server.clientlog = args.clientlog
+    server.metrics = Metrics()
+    server.history = History(config.get('HISTDIR') or None)
+    server.holders = Holders(config.get('DBDIR'))
+    server.clientlog = None
     server.config = config
     server.logger = logger
+    server.clienttimeout = int(config.get('TIMEOUT', 5))
+    server.maxqueries = int(config.get('MAXQUERIES', 1024))
+
+    # Limit connection rate per client and number of concurrent connections.
+    # Both are disabled unless set in the config.
+    rate = float(config.get('RATE', 0))
+    if rate > 0:
+        server.limiter = RateLimiter(rate,
+                                     int(config.get('BURST', 20)),
+                                     int(config.get('RATEPREFIX4', 32)),
+                                     int(config.get('RATEPREFIX6', 64)),
+                                     int(config.get('RATECLIENTS', 65536)))
+    maxconnections = int(config.get('MAXCONNECTIONS', 0))
+    if maxconnections > 0:
+        server.slots = threading.BoundedSemaphore(maxconnections)
 
     if args.daemon is True:
 
@@ -353,6 +994,30 @@ if __name__ == '__main__':
                 errmsg = 'Unable to write to file: {}'.format(args.clientlog)
                 logger.critical(errmsg)
                 exit(errmsg)
+        server.clientlog = ClientLog(args.clientlog,
+                                     int(config.get('LOGFLUSH', 1)),
+                                     int(config.get('LOGSYNC', 10)),
+                                     int(config.get('LOGMAXSIZE', 0)),
+                                     int(config.get('LOGMAXAGE', 0)),
+                                     int(config.get('LOGBACKUPS', 5)))
+        server.clientlog.start()
+
+    # Serve STATS queries in a separate thread
+    if statsport:
+        stats.metrics = server.metrics
+        stats.clienttimeout = server.clienttimeout
+        t = threading.Thread(target=stats.serve_forever, name='Stats')
+        t.daemon = True
+        t.start()
+
+    # Periodically write metrics to file
+    metricsfile = config.get('METRICSFILE')
+    if metricsfile:
+        t = threading.Thread(target=server.metrics.dump, name='Metrics',
+                             args=(metricsfile,
+                                   int(config.get('METRICSINTERVAL', 15))))
+        t.daemon = True
+        t.start()
 
     # Create an event for the shutdown process to set
     shutdown_event = threading.Event()